@@ -1,16 +1,76 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+
 from flask import Flask, request, render_template
 import mysql.connector
+import mysql.connector.pooling
 
 app = Flask(__name__)
 
-# Connect to MySQL
-mydb = mysql.connector.connect(
-    host="localhost",
-    user="root",       # change if your MySQL username is different
-    password="h6@CRwCw4E4qX@X",   # put your MySQL root password here
-    database="userdb"
-)
-cursor = mydb.cursor()
+# MySQL settings, overridable from the environment
+DB_CONFIG = {
+    'host': os.environ.get('MYSQL_HOST', "localhost"),
+    'user': os.environ.get('MYSQL_USER', "root"),       # change if your MySQL username is different
+    'password': os.environ.get('MYSQL_PASSWORD', "h6@CRwCw4E4qX@X"),   # put your MySQL root password here
+    'database': os.environ.get('MYSQL_DATABASE', "userdb"),
+}
+POOL_SIZE = int(os.environ.get('MYSQL_POOL_SIZE', 10))
+POOL_TIMEOUT = float(os.environ.get('MYSQL_POOL_TIMEOUT', 5))
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Create the connection pool on first use (after any worker fork)"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = mysql.connector.pooling.MySQLConnectionPool(
+                    pool_name="userdb",
+                    pool_size=POOL_SIZE,
+                    pool_reset_session=True,
+                    **DB_CONFIG
+                )
+    return _pool
+
+
+def get_connection():
+    """Borrow a pooled connection, waiting up to POOL_TIMEOUT if all are busy"""
+    deadline = time.monotonic() + POOL_TIMEOUT
+    while True:
+        try:
+            return get_pool().get_connection()
+        except mysql.connector.errors.PoolError:
+            # mysql.connector fails immediately on an exhausted pool
+            if time.monotonic() >= deadline:
+                raise
+            time.sleep(0.005)
+
+
+@contextmanager
+def get_cursor():
+    """Cursor on a pooled connection, reconnecting if the server dropped it"""
+    conn = get_connection()
+    try:
+        # Pooled connections can sit idle past wait_timeout
+        conn.ping(reconnect=True, attempts=3, delay=0.5)
+        cursor = conn.cursor()
+        try:
+            yield cursor
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+    finally:
+        # Returns the connection to the pool
+        conn.close()
+
 
 @app.route('/')
 def home():
@@ -21,22 +81,31 @@ def add_user():
     user_id = request.form['id']
     name = request.form['name']
 
-    # Insert into MySQL
-    sql = "INSERT INTO users (id, name) VALUES (%s, %s)"
+    # Insert into MySQL; rowcount is 0 when the id is already taken
+    sql = "INSERT INTO users (id, name) VALUES (%s, %s) ON DUPLICATE KEY UPDATE id = id"
     val = (user_id, name)
-    cursor.execute(sql, val)
-    mydb.commit()
+    with get_cursor() as cursor:
+        cursor.execute(sql, val)
+        inserted = cursor.rowcount == 1
+        if not inserted:
+            cursor.execute("SELECT name FROM users WHERE id = %s", (user_id,))
+            existing = cursor.fetchone()
+
+    if not inserted:
+        existing_name = existing[0] if existing else "unknown"
+        return f"User with ID {user_id} already exists: {existing_name}", 409
 
     return f"User {name} with ID {user_id} saved successfully!"
 
 @app.route('/user', methods=['GET'])
 def get_user():
     user_id = request.args.get('id')
-    
+
     # Fetch from MySQL
     sql = "SELECT name FROM users WHERE id = %s"
-    cursor.execute(sql, (user_id,))
-    result = cursor.fetchone()
+    with get_cursor() as cursor:
+        cursor.execute(sql, (user_id,))
+        result = cursor.fetchone()
 
     if result:
         return f"User found: {result[0]}"
@@ -0,0 +1,96 @@
+"""Admission control for database-bound requests.
+
+AdmissionControl wraps the WSGI app and lets at most max_concurrent
+requests run at once in this worker. Up to max_queue more wait, each for
+at most queue_timeout seconds; anything beyond that, or still waiting at
+its deadline, is shed with an immediate 503 and Retry-After. Under a DB
+latency spike the worker then serves a bounded number of requests at
+bounded latency instead of letting every request time out.
+"""
+import threading
+import time
+
+from werkzeug.wsgi import ClosingIterator
+
+import metrics
+
+queue_wait = metrics.Histogram('admission_queue_wait_seconds',
+                               'Time admitted requests waited for a slot')
+shed = metrics.Counter('admission_shed_total', 'Requests rejected with 503 by admission control')
+in_flight = metrics.Gauge('admission_in_flight', 'Requests currently holding a slot')
+queued = metrics.Gauge('admission_queued', 'Requests currently waiting for a slot')
+
+
+class AdmissionControl:
+    """WSGI middleware with a concurrency cap and a bounded, deadline-limited queue"""
+
+    def __init__(self, app, max_concurrent=8, max_queue=32, queue_timeout=1.0,
+                 retry_after=1, bypass=('/health',)):
+        self.app = app
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        self.bypass = tuple(bypass)
+        self.active = 0
+        self.waiting = 0
+        self._cond = threading.Condition()
+
+    def __call__(self, environ, start_response):
+        path = environ.get('PATH_INFO', '')
+        if path in self.bypass or path.startswith('/static/'):
+            return self.app(environ, start_response)
+
+        reason = self.acquire()
+        if reason is not None:
+            shed.inc(reason=reason)
+            start_response('503 Service Unavailable', [
+                ('Content-Type', 'text/plain; charset=utf-8'),
+                ('Retry-After', str(self.retry_after)),
+            ])
+            return [b'Server busy, please retry\n']
+
+        try:
+            response = self.app(environ, start_response)
+        except BaseException:
+            self.release()
+            raise
+        # The slot is held until the server has finished with the body
+        return ClosingIterator(response, self.release)
+
+    def acquire(self):
+        """Take a slot; returns None, or why the request was shed"""
+        started = time.monotonic()
+        with self._cond:
+            if self.active < self.max_concurrent and not self.waiting:
+                self.active += 1
+                in_flight.set(self.active)
+                queue_wait.observe(0.0)
+                return None
+            if self.waiting >= self.max_queue:
+                return 'queue_full'
+
+            self.waiting += 1
+            queued.set(self.waiting)
+            deadline = started + self.queue_timeout
+            try:
+                while self.active >= self.max_concurrent:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        # Pass on a wakeup this request may have consumed
+                        self._cond.notify()
+                        return 'timeout'
+                    self._cond.wait(remaining)
+            finally:
+                self.waiting -= 1
+                queued.set(self.waiting)
+            self.active += 1
+            in_flight.set(self.active)
+        queue_wait.observe(time.monotonic() - started)
+        return None
+
+    def release(self):
+        with self._cond:
+            self.active -= 1
+            in_flight.set(self.active)
+            self._cond.notify()
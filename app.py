@@ -1,135 +1,402 @@
+import atexit
+import hmac
+import math
 import os
-from flask import Flask, request, jsonify, render_template, redirect, url_for
-import psycopg
+import threading
+import time
+from functools import wraps
+from flask import (Flask, Response, request, jsonify, render_template, redirect, url_for, g, abort,
+                   make_response)
+
+import click
+from flask.cli import AppGroup
+from jinja2 import FileSystemBytecodeCache
+from markupsafe import Markup
+
+import deadlines
+import memprof
+import metrics
+import warmup
+from admission import AdmissionControl
+from compact_table import CompactTableStorage
+from fragcache import FragmentCache
+from freeids import FreeIdTracker
+from health import ReadinessChecker
+from idbitmap import IdIndex
+from idlease import IdLeaser, IdSpaceExhausted
+from snapshot import SnapshotStorage, build_snapshot
+from storage import get_storage, StorageError, StorageUnavailable
+from usercache import CachedStorage, dump_cache
+from write_behind import WriteBehindBatcher
 
 app = Flask(__name__)
 
-def get_db_connection():
-    """Get database connection"""
+# Compiled templates are shared by every worker through a bytecode cache
+# (JINJA_BYTECODE_DIR, default a per-user temp directory), so a recycled
+# or new worker loads them instead of compiling; fill it ahead of time
+# with `flask templates compile`
+if os.environ.get('TEMPLATE_BYTECODE_CACHE', '1') == '1':
+    bytecode_dir = os.environ.get('JINJA_BYTECODE_DIR')
+    if bytecode_dir:
+        os.makedirs(bytecode_dir, exist_ok=True)
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache(bytecode_dir)
+
+# Set by gunicorn.conf.py when the app is imported once in the master and
+# forked: per-worker threads then start from post_fork() instead of here
+PRELOADED = os.environ.get('GUNICORN_PRELOAD') == '1'
+
+# Backend chosen by STORAGE_BACKEND (postgres, sqlite, mysql or memory)
+database = storage = get_storage()
+
+# Serve reads from a memory-mapped snapshot plus recent writes, or from a
+# compact per-worker copy of the table, when configured. Both are kept
+# current from change reports, so need every worker's writes reported
+if ((os.environ.get('USER_SNAPSHOT_PATH') or os.environ.get('COMPACT_USER_TABLE') == '1')
+        and not database.shares_changes):
+    print(f"USER_SNAPSHOT_PATH and COMPACT_USER_TABLE ignored: "
+          f"the {database.name} backend does not report other workers' writes")
+elif os.environ.get('USER_SNAPSHOT_PATH'):
+    storage = SnapshotStorage(storage, os.environ['USER_SNAPSHOT_PATH'])
+elif os.environ.get('COMPACT_USER_TABLE') == '1':
+    storage = CompactTableStorage(storage, int(os.environ.get('COMPACT_MERGE_THRESHOLD', 4096)))
+
+# Cache single-user reads (USER_CACHE_TTL seconds, 0 = off) and coalesce
+# concurrent lookups of the same id into one query either way
+storage = CachedStorage(storage, float(os.environ.get('USER_CACHE_TTL', 0)),
+                        int(os.environ.get('USER_CACHE_SIZE', 100_000)))
+
+# Most recently used cached ids, saved at exit and primed at the next start
+HOT_KEYS_PATH = os.environ.get('HOT_KEYS_PATH')
+HOT_KEYS_LIMIT = int(os.environ.get('HOT_KEYS_LIMIT', 10_000))
+
+def save_hot_keys():
+    hot = storage.cache.hot_keys(HOT_KEYS_LIMIT)
+    if hot:
+        warmup.save_hot_keys(HOT_KEYS_PATH, hot)
+
+if HOT_KEYS_PATH and storage.cache.enabled:
+    atexit.register(save_hot_keys)
+
+# Binary dump of the hottest cache entries, every CACHE_DUMP_INTERVAL
+# seconds and at exit, reloaded at start if the table has not changed
+CACHE_DUMP_PATH = os.environ.get('CACHE_DUMP_PATH') if storage.cache.enabled else None
+CACHE_DUMP_INTERVAL = float(os.environ.get('CACHE_DUMP_INTERVAL', 60))
+CACHE_DUMP_MAX_AGE = float(os.environ.get('CACHE_DUMP_MAX_AGE', 3600))
+CACHE_DUMP_LIMIT = int(os.environ.get('CACHE_DUMP_LIMIT', 100_000))
+
+def dump_user_cache():
+    if not storage.cache.entries:
+        return
     try:
-        # Try DATABASE_URL first (easiest for Render)
-        database_url = os.environ.get('DATABASE_URL')
-        
-        # If not set, try individual variables
-        if not database_url:
-            db_host = os.environ.get('PGHOST')
-            db_port = os.environ.get('PGPORT', '5432')
-            db_name = os.environ.get('PGDATABASE')
-            db_user = os.environ.get('PGUSER')
-            db_password = os.environ.get('PGPASSWORD')
-            
-            if all([db_host, db_name, db_user, db_password]):
-                database_url = f"postgresql://{db_user}:{db_password}@{db_host}:{db_port}/{db_name}"
-            else:
-                print("ERROR: No database connection configured!")
-                print("Set either DATABASE_URL or PGHOST/PGDATABASE/PGUSER/PGPASSWORD")
-                return None
-        
-        print(f"Connecting to database...")
-        conn = psycopg.connect(database_url)
-        print("Database connection successful!")
-        return conn
-        
-    except Exception as e:
-        print(f"Database connection failed: {e}")
-        return None
+        # Read before the entries, so a write racing the dump makes it stale
+        version = storage.version()
+    except StorageError as e:
+        print(f"Skipping cache dump, no table version: {e}")
+        return
+    dump_cache(storage.cache, CACHE_DUMP_PATH, -1 if version is None else version, CACHE_DUMP_LIMIT)
+
+def dump_user_cache_periodically():
+    while True:
+        time.sleep(CACHE_DUMP_INTERVAL)
+        try:
+            dump_user_cache()
+        except Exception as e:
+            print(f"Cache dump failed: {e}")
+
+if CACHE_DUMP_PATH:
+    atexit.register(dump_user_cache)
+
+# Rendered user rows of each home page (HOME_PAGE_SIZE users per page, 0 =
+# all on one page), kept FRAGMENT_CACHE_TTL seconds (0 = off) and dropped
+# early for just the pages an add or delete lands in
+HOME_PAGE_SIZE = int(os.environ.get('HOME_PAGE_SIZE', 0)) or None
+fragments = FragmentCache(float(os.environ.get('FRAGMENT_CACHE_TTL', 0)),
+                          int(os.environ.get('FRAGMENT_CACHE_PAGES', 1000)))
+if fragments.enabled:
+    storage.subscribe(fragments.on_change)
+fragment_cache_hits = metrics.Counter('fragment_cache_hits_total', 'Home pages served from cached rows')
+fragment_cache_misses = metrics.Counter('fragment_cache_misses_total', 'Home pages rendered from the database')
+
+# Re-export the snapshot every USER_SNAPSHOT_REBUILD_INTERVAL seconds (0 =
+# only by `flask build-snapshot`); workers skip it if another just did
+SNAPSHOT_REBUILD_INTERVAL = float(os.environ.get('USER_SNAPSHOT_REBUILD_INTERVAL', 300))
+
+def rebuild_snapshot_periodically():
+    while True:
+        time.sleep(SNAPSHOT_REBUILD_INTERVAL)
+        try:
+            storage.backend.rebuild_if_older(SNAPSHOT_REBUILD_INTERVAL)
+        except Exception as e:
+            print(f"Snapshot rebuild failed: {e}")
+
+# Per-worker bitmap of existing ids, answering misses without the DB. Only
+# for backends that report other workers' writes: elsewhere it would
+# answer "not found" for users another worker just added
+id_index = None
+if os.environ.get('ID_BITMAP') == '1' and not database.shares_changes:
+    print(f"ID_BITMAP ignored: the {database.name} backend does not report other workers' writes")
+elif os.environ.get('ID_BITMAP') == '1':
+    id_index = IdIndex(storage, os.environ.get('ID_BITMAP_PATH'),
+                       float(os.environ.get('ID_BITMAP_MAX_AGE', 300)))
+    atexit.register(id_index.save)
+
+# Free id ranges for suggesting fresh ids on the add form, each suggestion
+# held in the database for FREE_ID_RESERVE_TTL seconds across workers
+free_ids = None
+if os.environ.get('FREE_ID_INDEX') == '1' and not database.shares_changes:
+    print(f"FREE_ID_INDEX ignored: the {database.name} backend does not report other workers' writes")
+elif os.environ.get('FREE_ID_INDEX') == '1':
+    free_ids = FreeIdTracker(storage, float(os.environ.get('FREE_ID_RESERVE_TTL', 60)))
+
+# Fill a blank ID on /add from per-worker leased id blocks
+id_leaser = None
+if os.environ.get('ID_ALLOCATION') == 'lease':
+    id_leaser = IdLeaser(storage, int(os.environ.get('ID_LEASE_BLOCK_SIZE', 1000)))
+
+# Group-commit /add inserts through a per-worker batcher
+batcher = None
+if os.environ.get('WRITE_BEHIND') == '1':
+    batcher = WriteBehindBatcher(storage,
+                                 max_rows=int(os.environ.get('WRITE_BEHIND_MAX_ROWS', 100)),
+                                 max_delay=float(os.environ.get('WRITE_BEHIND_MAX_DELAY_MS', 5)) / 1000)
+
+# Cap concurrent DB-bound requests per worker; excess waits briefly in a
+# bounded queue, then is shed with a 503
+if os.environ.get('ADMISSION_CONTROL') == '1':
+    app.wsgi_app = AdmissionControl(
+        app.wsgi_app,
+        max_concurrent=int(os.environ.get('ADMISSION_MAX_CONCURRENT', 8)),
+        max_queue=int(os.environ.get('ADMISSION_MAX_QUEUE', 32)),
+        queue_timeout=float(os.environ.get('ADMISSION_QUEUE_TIMEOUT_MS', 1000)) / 1000,
+        retry_after=int(os.environ.get('ADMISSION_RETRY_AFTER', 1)),
+        bypass=('/health', '/livez', '/readyz', '/metrics'),
+    )
+
+# Leased ids a client has already taken are skipped this many times
+ALLOCATION_ATTEMPTS = 5
+
+# The users.name column is VARCHAR(100) on Postgres and MySQL
+MAX_NAME_LENGTH = 100
+
+MAX_BATCH_IDS = 1000
+MAX_TRACE_FRAMES = 100
+MAX_DIFF_LIMIT = 1000
+MAX_FREE_IDS = 1000
+
+# Probes answer from a background ping every READINESS_INTERVAL seconds
+readiness = ReadinessChecker(storage, database, float(os.environ.get('READINESS_INTERVAL', 2)))
+
+deadline_exceeded = metrics.Counter('deadline_exceeded_total',
+                                    'Requests answered 504 after running out of their latency budget')
+
+def warm_worker():
+    try:
+        warmup.warm_up(app, storage, database,
+                       HOT_KEYS_PATH if storage.cache.enabled else None, HOT_KEYS_LIMIT,
+                       CACHE_DUMP_PATH, CACHE_DUMP_MAX_AGE)
+    finally:
+        readiness.warming = False
+
+def start_background():
+    """Start this process's warm-up and background index builds"""
+    if os.environ.get('WARMUP', '1') == '1':
+        readiness.warming = True
+        threading.Thread(target=warm_worker, name='warm-up', daemon=True).start()
+    if CACHE_DUMP_PATH:
+        threading.Thread(target=dump_user_cache_periodically, name='cache-dump', daemon=True).start()
+    if isinstance(storage.backend, CompactTableStorage) and storage.backend.table is None:
+        threading.Thread(target=storage.backend.load, name='compact-table-load', daemon=True).start()
+    if isinstance(storage.backend, SnapshotStorage) and SNAPSHOT_REBUILD_INTERVAL > 0:
+        threading.Thread(target=rebuild_snapshot_periodically, name='snapshot-rebuild', daemon=True).start()
+    if id_index is not None and not id_index.ready:
+        threading.Thread(target=id_index.start, name='id-bitmap-start', daemon=True).start()
+    if free_ids is not None and not free_ids.ready:
+        threading.Thread(target=free_ids.rebuild, name='free-ids-start', daemon=True).start()
+
+def warm_master():
+    """Build read-only state in a preloading master, to share with every worker
+
+    Compiled templates, the URL map and the snapshot mapping are then
+    inherited copy-on-write instead of being built again per worker.
+    Indexes that must track live changes are still built per worker.
+    """
+    warmup.compile_templates(app)
+    with app.test_request_context():
+        url_for('home')
+    if isinstance(storage.backend, SnapshotStorage):
+        storage.backend.refresh(force=True)
+
+def post_fork():
+    """Per-worker startup after forking from a preloading gunicorn master"""
+    database.after_fork()
+    fragments.invalidate()
+    if id_leaser is not None:
+        # Two workers must never hand out ids from the same leased block
+        id_leaser.reset()
+    start_background()
+    # Opens this worker's pool with its first ping
+    readiness.ensure_started()
+
+if not PRELOADED:
+    start_background()
 
 def initialize_database():
     """Initialize database with simple schema"""
-    conn = get_db_connection()
-    if conn is None:
-        return False
-        
     try:
-        with conn:
-            with conn.cursor() as cursor:
-                # Simple table without created_at
-                cursor.execute("""
-                    CREATE TABLE IF NOT EXISTS users(
-                        id INTEGER PRIMARY KEY,
-                        name VARCHAR(100) NOT NULL
-                    )
-                """)
-                print("Users table ready!")
+        storage.initialize()
         return True
+    except StorageUnavailable:
+        return False
     except Exception as e:
         print(f"Database initialization error: {e}")
         return False
-    finally:
-        if conn:
-            conn.close()
+
+def retry_after_headers(error):
+    """Retry-After for a 503 caused by the database circuit being open"""
+    if error.retry_after is None:
+        return {}
+    return {'Retry-After': str(max(1, math.ceil(error.retry_after)))}
+
+def deadline(seconds):
+    """Give a view a latency budget of `seconds`
+
+    Database calls inside it get the remainder as their statement_timeout
+    and lock_timeout. If the budget runs out the request is answered 504,
+    whatever the view made of the error.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            with deadlines.budget(seconds) as budget:
+                try:
+                    response = make_response(view(*args, **kwargs))
+                except deadlines.DeadlineExceeded:
+                    response = None
+            if not budget.exceeded:
+                return response
+            deadline_exceeded.inc(route=view.__name__)
+            print(f"Deadline of {seconds}s exceeded in {view.__name__}")
+            message = f'Request took longer than {seconds}s, please retry'
+            if response is not None and response.is_json:
+                return jsonify({'error': message}), 504
+            return render_template('index.html', error=message), 504
+        return wrapper
+    return decorator
+
+@app.context_processor
+def inject_id_allocation():
+    """Let the forms leave the ID blank when the server allocates it"""
+    return {'id_optional': id_leaser is not None}
+
+def insert_user(user_id, name):
+    """add_if_absent, group-committed when write-behind is on"""
+    if batcher is not None:
+        return batcher.add_if_absent(user_id, name)
+    return storage.add_if_absent(user_id, name)
+
+def add_with_allocated_id(name):
+    """Insert under a leased ID; returns the ID, or None if every attempt collided"""
+    for _ in range(ALLOCATION_ATTEMPTS):
+        user_id = id_leaser.allocate()
+        inserted, existing = insert_user(user_id, name)
+        if inserted:
+            return user_id
+        print(f"Leased ID {user_id} already taken by {existing}, trying the next one")
+    return None
 
 @app.route('/')
+@deadline(3.0)
 def home():
-    """Home page with user management interface"""
-    conn = get_db_connection()
-    users = []
-    
-    if conn:
+    """Home page with user management interface, HOME_PAGE_SIZE users after ?after="""
+    after_id = request.args.get('after', type=int)
+    page = fragments.get(after_id, HOME_PAGE_SIZE)
+    if fragments.enabled:
+        (fragment_cache_misses if page is None else fragment_cache_hits).inc()
+    if page is None:
+        generation = fragments.generation
         try:
-            with conn:
-                with conn.cursor() as cursor:
-                    cursor.execute("SELECT id, name FROM users ORDER BY id")
-                    users_data = cursor.fetchall()
-                    users = [{'id': user[0], 'name': user[1]} for user in users_data]
-                    print(f"Found {len(users)} users")
+            rows = storage.list_page(after_id, HOME_PAGE_SIZE)
+            print(f"Found {len(rows)} users")
+        except StorageUnavailable as e:
+            print("No database connection for home page")
+            return (render_template('index.html', error='Database connection failed'),
+                    503, retry_after_headers(e))
         except Exception as e:
             print(f"Error fetching users: {e}")
-        finally:
-            conn.close()
-    else:
-        print("No database connection for home page")
-    
-    return render_template('index.html', users=users)
+            return render_template('index.html')
+        ids = [user_id for user_id, _ in rows]
+        html = Markup(render_template('_user_rows.html',
+                                      users=[{'id': user_id, 'name': name} for user_id, name in rows])
+                      if rows else '')
+        next_after = ids[-1] if HOME_PAGE_SIZE is not None and len(ids) >= HOME_PAGE_SIZE else None
+        fragments.put(after_id, HOME_PAGE_SIZE, ids, html, next_after, generation)
+        page = html, next_after
+
+    user_rows, next_after = page
+    return render_template('index.html', user_rows=user_rows, next_after=next_after)
 
 @app.route('/add', methods=['GET', 'POST'])
+@deadline(2.0)
 def add_user():
     """Add a new user"""
     if request.method == 'GET':
-        return render_template('add_user.html')
+        suggested = free_ids.suggest(1) if free_ids is not None else []
+        return render_template('add_user.html', suggested_id=suggested[0] if suggested else None)
     
     try:
-        user_id = request.form.get('id')
+        user_id = request.form.get('id', '')
         name = request.form.get('name')
+        # Tested on the form string: 0 is a valid id, not a blank one
+        allocate = user_id == ''
         
-        if not user_id or not name:
+        if not name or (allocate and id_leaser is None):
             return render_template('add_user.html', error='Missing id or name')
         
-        try:
-            user_id = int(user_id)
-        except ValueError:
-            return render_template('add_user.html', error='ID must be a number')
+        if not allocate:
+            try:
+                user_id = int(user_id)
+            except ValueError:
+                return render_template('add_user.html', error='ID must be a number')
         
         name = name.strip()
         if not name:
             return render_template('add_user.html', error='Name cannot be empty')
+        if len(name) > MAX_NAME_LENGTH:
+            return render_template('add_user.html', error=f'Name cannot be longer than {MAX_NAME_LENGTH} characters')
+        
+        if allocate:
+            try:
+                user_id = add_with_allocated_id(name)
+            except StorageUnavailable as e:
+                return render_template('add_user.html', error='Database connection failed'), 503, retry_after_headers(e)
+            except IdSpaceExhausted as e:
+                print(f"Error in add_user: {e}")
+                return render_template('add_user.html', error='No free IDs left')
+            if user_id is None:
+                return render_template('add_user.html', error='Could not allocate a free ID, please retry')
+            print(f"Added user: ID={user_id}, Name={name}")
+            return redirect(url_for('home'))
+        
+        if id_index is not None and id_index.probably_present(user_id):
+            # A read (usually cached) instead of a write, and it names the owner
+            try:
+                existing = storage.get(user_id)
+            except StorageUnavailable as e:
+                return render_template('add_user.html', error='Database connection failed'), 503, retry_after_headers(e)
+            if existing is not None:
+                return render_template('add_user.html',
+                                     error=f'User with ID {user_id} already exists: {existing}')
+        
+        try:
+            inserted, existing = insert_user(user_id, name)
+        except StorageUnavailable as e:
+            return render_template('add_user.html', error='Database connection failed'), 503, retry_after_headers(e)
         
-        conn = get_db_connection()
-        if conn is None:
-            return render_template('add_user.html', error='Database connection failed')
-            
-        with conn:
-            with conn.cursor() as cursor:
-                # Create table if not exists
-                cursor.execute("""
-                    CREATE TABLE IF NOT EXISTS users(
-                        id INTEGER PRIMARY KEY,
-                        name VARCHAR(100) NOT NULL
-                    )
-                """)
-                
-                # Check if user exists
-                cursor.execute("SELECT name FROM users WHERE id = %s", (user_id,))
-                existing = cursor.fetchone()
-                
-                if existing:
-                    return render_template('add_user.html', 
-                                         error=f'User with ID {user_id} already exists: {existing[0]}')
-                
-                # Insert new user
-                cursor.execute("INSERT INTO users (id, name) VALUES (%s, %s)", (user_id, name))
-                print(f"Added user: ID={user_id}, Name={name}")
-                
+        if not inserted:
+            return render_template('add_user.html', 
+                                 error=f'User with ID {user_id} already exists: {existing}')
+        
+        print(f"Added user: ID={user_id}, Name={name}")
         return redirect(url_for('home'))
         
     except Exception as e:
@@ -137,6 +404,7 @@ def add_user():
         return render_template('add_user.html', error='Internal server error')
 
 @app.route('/user', methods=['GET'])
+@deadline(1.0)
 def get_user():
     """Find user by ID"""
     user_id = request.args.get('id')
@@ -149,65 +417,242 @@ def get_user():
     except ValueError:
         return render_template('index.html', error='ID must be a number')
     
-    conn = get_db_connection()
-    if conn is None:
-        return render_template('index.html', error='Database connection failed')
+    if id_index is not None and id_index.definitely_absent(user_id):
+        print(f"User with ID {user_id} not found")
+        return render_template('index.html', error=f'User with ID {user_id} not found')
     
     try:
-        with conn:
-            with conn.cursor() as cursor:
-                cursor.execute("SELECT id, name FROM users WHERE id = %s", (user_id,))
-                user = cursor.fetchone()
-                
-                if user:
-                    user_data = {'id': user[0], 'name': user[1]}
-                    print(f"Found user: {user_data}")
-                    return render_template('index.html', found_user=user_data)
-                else:
-                    print(f"User with ID {user_id} not found")
-                    return render_template('index.html', error=f'User with ID {user_id} not found')
-                    
+        name = storage.get(user_id)
+    except StorageUnavailable as e:
+        return render_template('index.html', error='Database connection failed'), 503, retry_after_headers(e)
     except Exception as e:
         print(f"Error in get_user: {e}")
         return render_template('index.html', error='Internal server error')
-    finally:
-        if conn:
-            conn.close()
+    
+    if name is not None:
+        user_data = {'id': user_id, 'name': name}
+        print(f"Found user: {user_data}")
+        return render_template('index.html', found_user=user_data)
+    else:
+        print(f"User with ID {user_id} not found")
+        return render_template('index.html', error=f'User with ID {user_id} not found')
+
+@app.route('/users', methods=['GET'])
+@deadline(2.0)
+def get_users():
+    """Batch lookup: /users?ids=1,2,3"""
+    try:
+        user_ids = [int(part) for part in request.args.get('ids', '').split(',') if part.strip()]
+    except ValueError:
+        return jsonify({'error': 'ids must be comma-separated numbers'}), 400
+    if not user_ids:
+        return jsonify({'error': 'Please provide user IDs'}), 400
+    if len(user_ids) > MAX_BATCH_IDS:
+        return jsonify({'error': f'At most {MAX_BATCH_IDS} IDs per request'}), 400
+    
+    lookup_ids = user_ids
+    if id_index is not None:
+        lookup_ids = [user_id for user_id in user_ids if not id_index.definitely_absent(user_id)]
+    
+    try:
+        found = storage.get_many(lookup_ids) if lookup_ids else {}
+    except StorageUnavailable as e:
+        return jsonify({'error': 'Database connection failed'}), 503, retry_after_headers(e)
+    except Exception as e:
+        print(f"Error in get_users: {e}")
+        return jsonify({'error': 'Internal server error'}), 500
+    
+    return jsonify({
+        'users': [{'id': user_id, 'name': found[user_id]} for user_id in user_ids if user_id in found],
+        'missing': [user_id for user_id in user_ids if user_id not in found],
+    })
+
+@app.route('/ids/next-free', methods=['GET'])
+def next_free_ids():
+    """Suggest unused IDs: /ids/next-free?count=n"""
+    count = int_arg('count', 1)
+    if count is None or not 1 <= count <= MAX_FREE_IDS:
+        return jsonify({'error': f'count must be between 1 and {MAX_FREE_IDS}'}), 400
+    if free_ids is None:
+        return jsonify({'error': 'Free ID index is not enabled'}), 404
+    if not free_ids.ready:
+        return jsonify({'error': 'Free ID index is still building'}), 503
+    
+    return jsonify({'ids': free_ids.suggest(count)})
 
 @app.route('/delete/<int:user_id>', methods=['POST'])
+@deadline(2.0)
 def delete_user(user_id):
     """Delete a user"""
-    conn = get_db_connection()
-    if conn is None:
-        return redirect(url_for('home'))
-    
     try:
-        with conn:
-            with conn.cursor() as cursor:
-                cursor.execute("DELETE FROM users WHERE id = %s", (user_id,))
-                print(f"Deleted user with ID: {user_id}")
-        return redirect(url_for('home'))
+        storage.delete(user_id)
+        print(f"Deleted user with ID: {user_id}")
+    except StorageUnavailable as e:
+        return render_template('index.html', error='Database connection failed'), 503, retry_after_headers(e)
     except Exception as e:
         print(f"Error deleting user: {e}")
-        return redirect(url_for('home'))
-    finally:
-        if conn:
-            conn.close()
+    return redirect(url_for('home'))
 
 @app.route('/health')
 def health_check():
-    """Health check endpoint"""
-    conn = get_db_connection()
-    status = "connected" if conn else "disconnected"
-    if conn:
-        conn.close()
+    """Health check endpoint, from the cached readiness check"""
+    _, details = readiness.report()
+    breaker = details.get('breaker')
     
     return jsonify({
         'status': 'healthy',
-        'database': status,
+        'database': details['database'],
+        'circuit': breaker['state'] if breaker else None,
         'service': 'user-info-app'
     })
 
+@app.route('/livez')
+def liveness():
+    """The process is up and serving; no I/O"""
+    return jsonify({'status': 'alive'})
+
+@app.route('/readyz')
+def readiness_check():
+    """503 until the last background ping succeeded and the circuit is closed"""
+    ready, details = readiness.report()
+    return jsonify(details), 200 if ready else 503
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """This worker's metrics in the Prometheus text format"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+def int_arg(name, default):
+    """Query argument name as an int, default if absent, None if malformed"""
+    value = request.args.get(name)
+    if value is None:
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        return None
+
+def admin_required(view):
+    """Only allow requests carrying the ADMIN_TOKEN in X-Admin-Token"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        token = os.environ.get('ADMIN_TOKEN')
+        given = request.headers.get('X-Admin-Token', '')
+        if not token or not hmac.compare_digest(given.encode(), token.encode()):
+            abort(404)
+        return view(*args, **kwargs)
+    return wrapper
+
+@app.before_request
+def track_request_memory():
+    """Remember traced memory at request start when route tracking is on"""
+    g.memprof_start = memprof.request_started()
+
+@app.after_request
+def record_request_memory(response):
+    """Attribute the request's net allocations to its route"""
+    started = g.pop('memprof_start', None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else '<unmatched>'
+        memprof.request_finished(route, started)
+    return response
+
+@app.route('/admin/memory', methods=['GET'])
+@admin_required
+def memory_status():
+    """tracemalloc state and snapshot names"""
+    return jsonify(memprof.status())
+
+@app.route('/admin/memory/start', methods=['POST'])
+@admin_required
+def memory_start():
+    """Start tracemalloc, optionally with per-route allocation counters"""
+    nframes = int_arg('frames', 1)
+    if nframes is None or not 1 <= nframes <= MAX_TRACE_FRAMES:
+        return jsonify({'error': f'frames must be between 1 and {MAX_TRACE_FRAMES}'}), 400
+    memprof.start(nframes)
+    if request.args.get('routes') in ('1', 'true', 'yes'):
+        memprof.enable_route_tracking()
+    return jsonify(memprof.status())
+
+@app.route('/admin/memory/stop', methods=['POST'])
+@admin_required
+def memory_stop():
+    """Stop tracemalloc and forget all snapshots"""
+    return jsonify(memprof.stop())
+
+@app.route('/admin/memory/snapshot/<name>', methods=['POST'])
+@admin_required
+def memory_snapshot(name):
+    """Take a named snapshot"""
+    try:
+        return jsonify(memprof.take_snapshot(name))
+    except RuntimeError as e:
+        return jsonify({'error': str(e)}), 409
+
+@app.route('/admin/memory/diff', methods=['GET'])
+@admin_required
+def memory_diff():
+    """Top-N allocation sites that grew between two snapshots"""
+    old_name = request.args.get('from')
+    new_name = request.args.get('to')
+    if not old_name or not new_name:
+        return jsonify({'error': 'Provide from and to snapshot names'}), 400
+
+    limit = int_arg('limit', 20)
+    if limit is None or not 1 <= limit <= MAX_DIFF_LIMIT:
+        return jsonify({'error': f'limit must be between 1 and {MAX_DIFF_LIMIT}'}), 400
+    key_type = request.args.get('by', 'lineno')
+    if key_type not in ('lineno', 'filename', 'traceback'):
+        return jsonify({'error': 'by must be lineno, filename or traceback'}), 400
+
+    try:
+        return jsonify(memprof.diff(old_name, new_name, limit, key_type))
+    except KeyError as e:
+        return jsonify({'error': e.args[0]}), 404
+
+@app.route('/admin/memory/processes', methods=['GET'])
+@admin_required
+def memory_processes():
+    """Shared vs private RSS of the gunicorn master (default: our parent) and its workers"""
+    master_pid = int_arg('master', os.getppid())
+    if master_pid is None or master_pid <= 0:
+        return jsonify({'error': 'master must be a process id'}), 400
+    try:
+        return jsonify(memprof.worker_memory_report(master_pid))
+    except OSError as e:
+        return jsonify({'error': f'Cannot read memory of process {master_pid}: {e}'}), 404
+
+@app.route('/admin/memory/routes', methods=['GET'])
+@admin_required
+def memory_routes():
+    """Net traced allocations attributed to each route"""
+    return jsonify({'routes': memprof.route_report()})
+
+@app.cli.command('build-snapshot')
+@click.option('--path', default=lambda: os.environ.get('USER_SNAPSHOT_PATH', 'users.snapshot'),
+              help='Snapshot file to (atomically) replace')
+def build_snapshot_command(path):
+    """Export all users into the memory-mapped snapshot file"""
+    if isinstance(storage.backend, SnapshotStorage) and storage.backend.path == path:
+        storage.backend.rebuild()
+    else:
+        build_snapshot(storage.export(), path)
+
+templates_cli = AppGroup('templates', help='Template maintenance')
+
+@templates_cli.command('compile')
+def compile_templates_command():
+    """Compile every template into the bytecode cache"""
+    if app.jinja_env.bytecode_cache is None:
+        raise click.ClickException('The template bytecode cache is disabled (TEMPLATE_BYTECODE_CACHE=0)')
+    names = app.jinja_env.list_templates()
+    warmup.compile_templates(app)
+    cache = app.jinja_env.bytecode_cache
+    click.echo(f"Compiled {len(names)} templates into {cache.directory}")
+
+app.cli.add_command(templates_cli)
+
 # Initialize database when app starts
 if __name__ == '__main__':
     print("🚀 Starting User Info App...")
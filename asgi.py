@@ -0,0 +1,10 @@
+"""ASGI entry point for WORKER_CLASS=asgi (uvicorn workers under gunicorn).
+
+The Flask app is WSGI, so asgiref runs it on a thread pool behind the
+event loop. Needs `pip install uvicorn asgiref`.
+"""
+from asgiref.wsgi import WsgiToAsgi
+
+from app import app
+
+application = WsgiToAsgi(app)
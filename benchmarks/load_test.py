@@ -0,0 +1,314 @@
+"""HTTP load generator for the user info app.
+
+Drives a running instance (Flask dev server or gunicorn, ideally against a
+local Postgres) with a weighted mix of requests and prints a JSON report.
+
+    python benchmarks/load_test.py --url http://127.0.0.1:10000 \\
+        --mix home=1,get=8,add=1,delete=1 --mode open --rps 500 --duration 30
+
+Closed loop runs --users virtual users back to back; open loop sends at a
+fixed target rate and measures latency from the scheduled send time, so a
+stalled server shows up as latency instead of silently lowering the rate.
+"""
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+from urllib.parse import urlencode, urlsplit
+
+ROUTES = ('home', 'get', 'add', 'delete')
+
+
+class HTTPConnection:
+    """Minimal keep-alive HTTP/1.1 client connection"""
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.reader = None
+        self.writer = None
+
+    async def request(self, method, path, body=b'', content_type=None):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+
+        lines = [f"{method} {path} HTTP/1.1", f"Host: {self.host}:{self.port}",
+                 "Connection: keep-alive", f"Content-Length: {len(body)}"]
+        if content_type:
+            lines.append(f"Content-Type: {content_type}")
+        self.writer.write(("\r\n".join(lines) + "\r\n\r\n").encode('latin-1') + body)
+        await self.writer.drain()
+
+        status_line = await self.reader.readline()
+        if not status_line:
+            raise ConnectionError('server closed the connection')
+        status = int(status_line.split()[1])
+
+        headers = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            key, _, value = line.decode('latin-1').partition(':')
+            headers[key.strip().lower()] = value.strip()
+
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            while True:
+                size = int((await self.reader.readline()).split(b';')[0], 16)
+                await self.reader.readexactly(size + 2)
+                if size == 0:
+                    break
+        elif 'content-length' in headers:
+            await self.reader.readexactly(int(headers['content-length']))
+        else:
+            await self.reader.read()
+            self.close()
+
+        keep_alive = status_line.startswith(b'HTTP/1.1') or \
+            headers.get('connection', '').lower() == 'keep-alive'
+        if headers.get('connection', '').lower() == 'close' or not keep_alive:
+            self.close()
+        return status
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+
+class ConnectionPool:
+    """Bounded pool of keep-alive connections"""
+
+    def __init__(self, host, port, size):
+        self.host = host
+        self.port = port
+        self.idle = asyncio.Queue()
+        for _ in range(size):
+            self.idle.put_nowait(HTTPConnection(host, port))
+
+    async def request(self, *args, **kwargs):
+        conn = await self.idle.get()
+        try:
+            return await conn.request(*args, **kwargs)
+        except Exception:
+            conn.close()
+            raise
+        finally:
+            self.idle.put_nowait(conn)
+
+    def close(self):
+        while not self.idle.empty():
+            self.idle.get_nowait().close()
+
+
+def parse_mix(text):
+    """Parse 'home=1,get=8' into a list of (route, weight)"""
+    mix = []
+    for part in text.split(','):
+        route, _, weight = part.partition('=')
+        route = route.strip()
+        if route not in ROUTES:
+            raise argparse.ArgumentTypeError(f"Unknown route '{route}', expected one of {ROUTES}")
+        mix.append((route, float(weight or 1)))
+    return mix
+
+
+class Workload:
+    """Turns route names into concrete requests"""
+
+    def __init__(self, args):
+        self.rng = random.Random(args.random_seed)
+        self.routes = [route for route, _ in args.mix]
+        self.weights = [weight for _, weight in args.mix]
+        self.id_max = max(args.seed_users, 1)
+        self.next_id = args.id_offset + self.id_max + 1
+        self.id_offset = args.id_offset
+
+    def next_request(self):
+        route = self.rng.choices(self.routes, self.weights)[0]
+        if route == 'home':
+            return route, 'GET', '/', b''
+        if route == 'get':
+            user_id = self.id_offset + self.rng.randint(1, self.id_max)
+            return route, 'GET', f"/user?id={user_id}", b''
+        if route == 'add':
+            user_id = self.next_id
+            self.next_id += 1
+            body = urlencode({'id': user_id, 'name': f"user-{user_id}"}).encode()
+            return route, 'POST', '/add', body
+        user_id = self.next_id - 1 - self.rng.randrange(max(self.next_id - self.id_offset - 1, 1))
+        return route, 'POST', f"/delete/{user_id}", b''
+
+
+class Recorder:
+    """Collects latencies and errors per route"""
+
+    def __init__(self):
+        self.latencies = {route: [] for route in ROUTES}
+        self.errors = {route: 0 for route in ROUTES}
+        self.recording = False
+
+    def record(self, route, latency, ok):
+        if not self.recording:
+            return
+        self.latencies[route].append(latency)
+        if not ok:
+            self.errors[route] += 1
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(fraction * len(sorted_values)))
+    return sorted_values[index]
+
+
+def summarize(latencies, errors, elapsed):
+    ordered = sorted(latencies)
+    count = len(ordered)
+    return {
+        'requests': count,
+        'errors': errors,
+        'error_rate': errors / count if count else 0.0,
+        'throughput_rps': count / elapsed if elapsed else 0.0,
+        'latency_ms': {
+            'mean': _ms(sum(ordered) / count if count else None),
+            'p50': _ms(percentile(ordered, 0.50)),
+            'p90': _ms(percentile(ordered, 0.90)),
+            'p99': _ms(percentile(ordered, 0.99)),
+            'p999': _ms(percentile(ordered, 0.999)),
+            'max': _ms(ordered[-1] if ordered else None),
+        },
+    }
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 3)
+
+
+async def send(pool, recorder, request, scheduled):
+    route, method, path, body = request
+    content_type = 'application/x-www-form-urlencoded' if method == 'POST' else None
+    try:
+        status = await pool.request(method, path, body, content_type)
+        ok = status < 500
+    except (OSError, asyncio.IncompleteReadError, ValueError):
+        ok = False
+    recorder.record(route, time.perf_counter() - scheduled, ok)
+
+
+async def seed_users(pool, args):
+    """Insert users id_offset+1 .. id_offset+seed_users before the run"""
+    print(f"Seeding {args.seed_users} users...", file=sys.stderr)
+    semaphore = asyncio.Semaphore(args.connections)
+
+    async def add(user_id):
+        async with semaphore:
+            body = urlencode({'id': user_id, 'name': f"user-{user_id}"}).encode()
+            await pool.request('POST', '/add', body, 'application/x-www-form-urlencoded')
+
+    start = args.id_offset + 1
+    await asyncio.gather(*(add(user_id) for user_id in range(start, start + args.seed_users)))
+
+
+async def run_closed(pool, workload, recorder, args, stop_at):
+    async def user():
+        while time.perf_counter() < stop_at:
+            await send(pool, recorder, workload.next_request(), time.perf_counter())
+
+    await asyncio.gather(*(user() for _ in range(args.users)))
+
+
+async def run_open(pool, workload, recorder, args, stop_at):
+    interval = 1.0 / args.rps
+    tasks = set()
+    scheduled = time.perf_counter()
+    while scheduled < stop_at:
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        task = asyncio.create_task(send(pool, recorder, workload.next_request(), scheduled))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+        scheduled += interval
+    if tasks:
+        await asyncio.gather(*tasks)
+
+
+async def main_async(args):
+    url = urlsplit(args.url)
+    pool = ConnectionPool(url.hostname, url.port or 80, args.connections)
+    workload = Workload(args)
+    recorder = Recorder()
+
+    try:
+        if args.seed_users and not args.skip_seed:
+            await seed_users(pool, args)
+
+        runner = run_open if args.mode == 'open' else run_closed
+        if args.warmup > 0:
+            await runner(pool, workload, recorder, args, time.perf_counter() + args.warmup)
+
+        recorder.recording = True
+        started = time.perf_counter()
+        await runner(pool, workload, recorder, args, started + args.duration)
+        elapsed = time.perf_counter() - started
+    finally:
+        pool.close()
+
+    all_latencies = [lat for route in ROUTES for lat in recorder.latencies[route]]
+    report = {
+        'config': {
+            'url': args.url,
+            'mode': args.mode,
+            'mix': dict(args.mix),
+            'duration_s': args.duration,
+            'target_rps': args.rps if args.mode == 'open' else None,
+            'users': args.users if args.mode == 'closed' else None,
+            'connections': args.connections,
+            'seed_users': args.seed_users,
+        },
+        'elapsed_s': round(elapsed, 3),
+        'overall': summarize(all_latencies, sum(recorder.errors.values()), elapsed),
+        'routes': {
+            route: summarize(recorder.latencies[route], recorder.errors[route], elapsed)
+            for route in ROUTES if recorder.latencies[route]
+        },
+    }
+    return report
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='Load test the user info app')
+    parser.add_argument('--url', default='http://127.0.0.1:10000', help='Base URL of the app')
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix('home=1,get=8,add=1'),
+                        help='Weighted request mix, e.g. home=1,get=8,add=1,delete=1')
+    parser.add_argument('--mode', choices=('open', 'closed'), default='closed')
+    parser.add_argument('--rps', type=float, default=200.0, help='Target rate in open loop mode')
+    parser.add_argument('--users', type=int, default=16, help='Virtual users in closed loop mode')
+    parser.add_argument('--connections', type=int, default=64, help='Max keep-alive connections')
+    parser.add_argument('--duration', type=float, default=30.0, help='Measured seconds')
+    parser.add_argument('--warmup', type=float, default=5.0, help='Unmeasured warm-up seconds')
+    parser.add_argument('--seed-users', type=int, default=1000, help='Users inserted before the run')
+    parser.add_argument('--skip-seed', action='store_true', help='Assume users are already seeded')
+    parser.add_argument('--id-offset', type=int, default=1_000_000,
+                        help='First seeded ID is offset + 1, keeping benchmark rows apart')
+    parser.add_argument('--random-seed', type=int, default=42)
+    parser.add_argument('--output', help='Also write the JSON report to this file')
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    report = asyncio.run(main_async(args))
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,256 @@
+"""In-process microbenchmarks for the app's request handlers.
+
+Requests go through Flask's test client against an in-memory fake of the
+psycopg connection (or the in-memory storage backend), so the numbers are
+per-request Python overhead (routing, form parsing, template rendering,
+jsonify) plus whatever latency is injected with --db-latency-ms.
+
+    python benchmarks/micro_bench.py --output bench.json
+    python benchmarks/micro_bench.py --save-baseline benchmarks/baseline.json
+    python benchmarks/micro_bench.py --baseline benchmarks/baseline.json --threshold 0.10
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as app_module  # noqa: E402
+from storage import InMemoryStorage, PostgresStorage  # noqa: E402
+
+
+class FakeCursor:
+    """Answers the app's fixed query set from a dict"""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.result = []
+        self.rowcount = -1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql, params=(), prepare=None):
+        self.conn.statements += 1
+        if self.conn.latency:
+            time.sleep(self.conn.latency)
+
+        users = self.conn.users
+        statement = ' '.join(sql.split()).upper()
+        if statement.startswith('WITH INS AS (INSERT INTO USERS'):
+            user_id = params['id']
+            if user_id in users:
+                self.result = [(False, users[user_id])]
+            else:
+                users[user_id] = params['name']
+                self.result = [(True, None)]
+        elif statement.startswith('SELECT ID, NAME FROM USERS WHERE ID >'):
+            after_id, limit = params
+            rows = sorted(item for item in users.items() if item[0] > after_id)
+            self.result = rows[:limit] if limit is not None else rows
+        elif statement.startswith('SELECT ID, NAME FROM USERS ORDER BY ID'):
+            rows = sorted(users.items())
+            self.result = rows[:params[0]] if params and params[0] is not None else rows
+        elif statement.startswith('SELECT ID, NAME FROM USERS WHERE ID'):
+            user_id = params[0]
+            self.result = [(user_id, users[user_id])] if user_id in users else []
+        elif statement.startswith('DELETE FROM USERS'):
+            self.rowcount = 1 if users.pop(params[0], None) is not None else 0
+            self.result = []
+        elif statement.startswith('SELECT 1'):
+            self.result = [(1,)]
+        else:
+            self.result = []
+        return self
+
+    def fetchone(self):
+        return self.result[0] if self.result else None
+
+    def fetchall(self):
+        return list(self.result)
+
+
+class FakeConnection:
+    """Stand-in for a psycopg connection backed by a shared dict"""
+
+    def __init__(self, users, latency):
+        self.users = users
+        self.latency = latency
+        self.statements = 0
+        self.prepared_max = 100
+        self.prepare_threshold = 5
+        self.autocommit = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def execute(self, sql, params=(), prepare=None):
+        return FakeCursor(self).execute(sql, params)
+
+    def commit(self):
+        pass
+
+    @contextlib.contextmanager
+    def pipeline(self):
+        yield
+
+    @contextlib.contextmanager
+    def transaction(self):
+        yield
+
+    def close(self):
+        pass
+
+
+def build_cases(seed):
+    """Benchmark name -> (setup, request function)"""
+    counter = iter(range(10_000_000, 20_000_000))
+
+    def add_user(client):
+        user_id = next(counter)
+        return client.post('/add', data={'id': str(user_id), 'name': f"user-{user_id}"})
+
+    cases = {
+        'routing_not_found': (lambda: seed(10), lambda client: client.get('/no-such-route')),
+        'jsonify_health': (lambda: seed(10), lambda client: client.get('/health')),
+        'add_form_get': (lambda: seed(10), lambda client: client.get('/add')),
+        'add_form_post': (lambda: seed(10), add_user),
+        'get_user_hit': (lambda: seed(1000), lambda client: client.get('/user?id=500')),
+        'get_user_miss': (lambda: seed(1000), lambda client: client.get('/user?id=999999')),
+    }
+    for count in (10, 1_000, 100_000):
+        cases[f"render_home_{count}"] = (
+            lambda count=count: seed(count),
+            lambda client: client.get('/'),
+        )
+    return cases
+
+
+def run_case(client, setup, request, iterations, repeats):
+    setup()
+    request(client)
+    samples = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        for _ in range(iterations):
+            request(client)
+        samples.append((time.perf_counter() - started) / iterations)
+    return {
+        'iterations': iterations,
+        'repeats': repeats,
+        'best_us': round(min(samples) * 1e6, 2),
+        'median_us': round(statistics.median(samples) * 1e6, 2),
+    }
+
+
+def iterations_for(name, default):
+    """Scale iterations down for the large render cases"""
+    if name == 'render_home_100000':
+        return max(1, default // 100)
+    if name == 'render_home_1000':
+        return max(1, default // 10)
+    return default
+
+
+def compare(results, baseline, threshold):
+    """Names of benchmarks whose median regressed by more than threshold"""
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get('benchmarks', {}).get(name)
+        if not base:
+            continue
+        change = result['median_us'] / base['median_us'] - 1
+        result['change_vs_baseline'] = round(change, 4)
+        if change > threshold:
+            regressions.append(name)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Microbenchmark the Flask handlers')
+    parser.add_argument('--backend', choices=('fake-postgres', 'memory'), default='fake-postgres',
+                        help='Postgres code path on a fake connection, or the in-memory storage')
+    parser.add_argument('--db-latency-ms', type=float, default=0.0,
+                        help='Simulated latency per executed statement')
+    parser.add_argument('--iterations', type=int, default=500)
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--only', help='Comma-separated benchmark names to run')
+    parser.add_argument('--output', help='Write results JSON here')
+    parser.add_argument('--save-baseline', help='Write results JSON as the new baseline')
+    parser.add_argument('--baseline', help='Compare against this baseline JSON')
+    parser.add_argument('--threshold', type=float, default=0.10,
+                        help='Allowed median slowdown vs baseline (0.10 = 10%%)')
+    args = parser.parse_args(argv)
+
+    latency = args.db_latency_ms / 1000
+    if args.backend == 'memory':
+        app_module.storage = InMemoryStorage()
+
+        def seed(count):
+            app_module.storage.users.clear()
+            app_module.storage.bulk_load((i, f"user-{i}") for i in range(1, count + 1))
+    else:
+        users = {}
+        app_module.storage = PostgresStorage(connect=lambda: FakeConnection(users, latency),
+                                             pool_max=0)
+
+        def seed(count):
+            users.clear()
+            users.update((i, f"user-{i}") for i in range(1, count + 1))
+    client = app_module.app.test_client()
+
+    cases = build_cases(seed)
+    if args.only:
+        wanted = set(args.only.split(','))
+        cases = {name: case for name, case in cases.items() if name in wanted}
+
+    results = {}
+    for name, (setup, request) in cases.items():
+        # The handlers print on every request; keep that out of the timings
+        with contextlib.redirect_stdout(io.StringIO()):
+            results[name] = run_case(client, setup, request,
+                                     iterations_for(name, args.iterations), args.repeats)
+        print(f"{name:24} median {results[name]['median_us']:>12} us", file=sys.stderr)
+
+    report = {
+        'python': platform.python_version(),
+        'backend': args.backend,
+        'db_latency_ms': args.db_latency_ms,
+        'benchmarks': results,
+    }
+
+    exit_code = 0
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        report['regressions'] = regressions
+        if regressions:
+            print(f"Regressions over {args.threshold:.0%}: {', '.join(regressions)}", file=sys.stderr)
+            exit_code = 1
+
+    text = json.dumps(report, indent=2)
+    print(text)
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, 'w') as f:
+                f.write(text + '\n')
+    return exit_code
+
+
+if __name__ == '__main__':
+    sys.exit(main())
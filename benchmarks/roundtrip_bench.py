@@ -0,0 +1,185 @@
+"""Round trips per storage operation against a latency-injected Postgres.
+
+Starts a TCP proxy in front of a real Postgres that delays every packet by
+half of --latency-ms in each direction and counts round trips (a client
+send that follows a server reply). Each scenario runs in the baseline mode
+(no pipelining, reads inside BEGIN/COMMIT) and the optimized one
+(pipelined writes, autocommit reads), so the saving shows up both as
+round trips per op and as wall-clock latency.
+
+    python benchmarks/roundtrip_bench.py --dsn postgresql://localhost/bench --latency-ms 2
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+
+import psycopg
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from storage import PostgresStorage  # noqa: E402
+
+
+class LatencyProxy:
+    """Asyncio TCP proxy adding one-way delay and counting round trips"""
+
+    def __init__(self, target_host, target_port, one_way_delay):
+        self.target_host = target_host
+        self.target_port = target_port
+        self.delay = one_way_delay
+        self.round_trips = 0
+        self.loop = asyncio.new_event_loop()
+        self.port = None
+
+    def start(self):
+        ready = threading.Event()
+
+        def run():
+            asyncio.set_event_loop(self.loop)
+            server = self.loop.run_until_complete(
+                asyncio.start_server(self._handle, '127.0.0.1', 0))
+            self.port = server.sockets[0].getsockname()[1]
+            ready.set()
+            self.loop.run_forever()
+
+        threading.Thread(target=run, name='latency-proxy', daemon=True).start()
+        ready.wait()
+        return self
+
+    async def _handle(self, client_reader, client_writer):
+        server_reader, server_writer = await asyncio.open_connection(self.target_host, self.target_port)
+        state = {'last': 'server'}
+        await asyncio.gather(
+            self._pump(client_reader, server_writer, state, 'client'),
+            self._pump(server_reader, client_writer, state, 'server'),
+            return_exceptions=True,
+        )
+
+    async def _pump(self, reader, writer, state, side):
+        """Forward chunks in order, each delivered `delay` after it was read"""
+        queue = asyncio.Queue()
+
+        async def deliver():
+            while True:
+                due, data = await queue.get()
+                if data is None:
+                    writer.close()
+                    return
+                wait = due - time.monotonic()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                writer.write(data)
+                await writer.drain()
+
+        delivery = asyncio.ensure_future(deliver())
+        while True:
+            data = await reader.read(65536)
+            if not data:
+                queue.put_nowait((0, None))
+                break
+            if side == 'client' and state['last'] == 'server':
+                self.round_trips += 1
+            state['last'] = side
+            queue.put_nowait((time.monotonic() + self.delay, data))
+        await delivery
+
+
+def proxied_dsn(dsn, port):
+    params = psycopg.conninfo.conninfo_to_dict(dsn)
+    params['host'] = '127.0.0.1'
+    params['port'] = str(port)
+    return psycopg.conninfo.make_conninfo(**params)
+
+
+def scenarios(storage, base_id):
+    """Name -> function(i) running one storage operation"""
+    return {
+        'get': lambda i: storage.get(base_id + i),
+        'get_many': lambda i: storage.get_many([base_id + i, base_id + i + 1]),
+        'list_page': lambda i: storage.list_page(base_id + i, 10),
+        'add_if_absent': lambda i: storage.add_if_absent(base_id + i, f"bench-{i}"),
+        'add_if_absent_conflict': lambda i: storage.add_if_absent(base_id + i, 'dup'),
+        'delete': lambda i: storage.delete(base_id + i),
+        'lease_id_block': lambda i: storage.lease_id_block(10),
+    }
+
+
+MODES = {
+    'baseline': {'pipeline': False, 'autocommit_reads': False},
+    'optimized': {'pipeline': True, 'autocommit_reads': True},
+}
+
+
+def run(dsn, proxy, mode, operations, base_id, listen):
+    storage = PostgresStorage(conninfo=proxied_dsn(dsn, proxy.port), pool_min=1, pool_max=1,
+                              **MODES[mode])
+    storage.initialize()
+    if listen:
+        # Also run the LISTEN connection, as when id indexes or caches are on
+        # (writes notify from a trigger either way)
+        storage.subscribe(lambda *change: None)
+    results = {}
+    try:
+        for name, operation in scenarios(storage, base_id).items():
+            operation(-1)  # warm the pool connection
+            proxy.round_trips = 0
+            started = time.perf_counter()
+            for i in range(operations):
+                operation(i)
+            elapsed = time.perf_counter() - started
+            results[name] = {
+                'round_trips_per_op': round(proxy.round_trips / operations, 2),
+                'mean_ms': round(elapsed / operations * 1000, 3),
+            }
+    finally:
+        with psycopg.connect(dsn, autocommit=True) as conn:
+            conn.execute("DELETE FROM users WHERE id >= %s AND id < %s",
+                         (base_id - 1, base_id + operations))
+        storage.close()
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Measure round trips per storage operation')
+    parser.add_argument('--dsn', default=os.environ.get('DATABASE_URL'),
+                        help='Postgres to benchmark against (default DATABASE_URL)')
+    parser.add_argument('--latency-ms', type=float, default=2.0, help='Injected round-trip latency')
+    parser.add_argument('--operations', type=int, default=200)
+    parser.add_argument('--base-id', type=int, default=2_000_000_000,
+                        help='Benchmark rows use ids from here up')
+    parser.add_argument('--listen', action='store_true',
+                        help='Run the change listener, as when id indexes or caches are on')
+    parser.add_argument('--output', help='Also write the JSON report here')
+    args = parser.parse_args(argv)
+    if not args.dsn:
+        parser.error('--dsn or DATABASE_URL is required')
+
+    params = psycopg.conninfo.conninfo_to_dict(args.dsn)
+    proxy = LatencyProxy(params.get('host') or '127.0.0.1', int(params.get('port') or 5432),
+                         args.latency_ms / 2000).start()
+
+    report = {
+        'latency_ms': args.latency_ms,
+        'operations': args.operations,
+        'listen': args.listen,
+        'pipeline_supported': psycopg.Pipeline.is_supported(),
+        'results': {},
+    }
+    for mode in MODES:
+        print(f"Running {mode}...", file=sys.stderr)
+        report['results'][mode] = run(args.dsn, proxy, mode, args.operations,
+                                      args.base_id, args.listen)
+
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""Circuit breaker for database calls.
+
+While closed, calls go through and their outcomes fill a sliding window.
+Once the window holds at least min_calls outcomes and the failure rate
+reaches failure_rate, the breaker opens: calls fail at once with
+CircuitOpen instead of each worker waiting out a connect timeout. After a
+jittered delay, doubling with every consecutive trip, a single half-open
+probe is let through; its success closes the breaker, its failure opens it
+again for longer.
+"""
+import random
+import threading
+import time
+from collections import deque
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitOpen(Exception):
+    """The breaker is rejecting calls; retry after retry_after seconds"""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Circuit open, retry in {retry_after:.1f}s")
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """Failure-rate breaker with jittered exponential half-open backoff"""
+
+    def __init__(self, failure_rate=0.5, window=20, min_calls=5,
+                 open_seconds=1.0, max_open_seconds=30.0):
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.open_seconds = open_seconds
+        self.max_open_seconds = max_open_seconds
+        self.outcomes = deque(maxlen=window)
+        self.state = CLOSED
+        self.trips = 0
+        self.rejected = 0
+        self.open_until = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        """Raise CircuitOpen unless this call may go through"""
+        with self._lock:
+            if self.state == CLOSED:
+                return
+            now = time.monotonic()
+            if self.state == OPEN and now >= self.open_until:
+                self.state = HALF_OPEN
+            if self.state == HALF_OPEN and not self._probing:
+                self._probing = True
+                return
+            self.rejected += 1
+            raise CircuitOpen(max(self.open_until - now, 0.0))
+
+    def record_success(self):
+        with self._lock:
+            if self.state == HALF_OPEN:
+                print("Database circuit closed")
+                self.state = CLOSED
+                self.trips = 0
+                self.outcomes.clear()
+            self._probing = False
+            self.outcomes.append(True)
+
+    def record_inconclusive(self):
+        """A call that proved nothing either way; frees the probe slot"""
+        with self._lock:
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._probing = False
+            if self.state == HALF_OPEN:
+                self._open()
+                return
+            self.outcomes.append(False)
+            if self.state == CLOSED and len(self.outcomes) >= self.min_calls:
+                failures = self.outcomes.count(False)
+                if failures / len(self.outcomes) >= self.failure_rate:
+                    self._open()
+
+    def _open(self):
+        # Jitter keeps workers (and nodes) from probing in lockstep
+        delay = min(self.open_seconds * 2 ** self.trips, self.max_open_seconds)
+        delay *= random.uniform(0.5, 1.0)
+        self.state = OPEN
+        self.trips += 1
+        self.open_until = time.monotonic() + delay
+        self.outcomes.clear()
+        print(f"Database circuit open for {delay:.1f}s (trip {self.trips})")
+
+    def stats(self):
+        with self._lock:
+            failures = self.outcomes.count(False)
+            return {
+                'state': self.state,
+                'trips': self.trips,
+                'rejected': self.rejected,
+                'window_calls': len(self.outcomes),
+                'window_failures': failures,
+                'retry_after': max(self.open_until - time.monotonic(), 0.0) if self.state != CLOSED else 0.0,
+            }
@@ -0,0 +1,321 @@
+"""Compact in-memory copy of the users table.
+
+The bulk of the table lives in three flat buffers: a sorted int64 id
+array, a uint64 offsets array and one packed UTF-8 name blob, about
+16 bytes per user plus the name itself. Recent inserts and deletes sit in
+a small side buffer that is merged into the arrays once it grows past
+merge_threshold entries.
+
+NumPy is used for vectorized batch lookups when it is installed; without
+it the same arrays are searched with bisect.
+"""
+import bisect
+import threading
+from array import array
+
+from storage import Storage
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - numpy is optional
+    np = None
+
+
+class _Main:
+    """Immutable merged part of the table"""
+
+    def __init__(self, ids, offsets, names):
+        self.ids = ids
+        self.offsets = offsets
+        self.names = names
+        self.ids_np = np.frombuffer(ids, dtype=np.int64) if np is not None and len(ids) else None
+
+    def __len__(self):
+        return len(self.ids)
+
+    def index_of(self, user_id):
+        index = bisect.bisect_left(self.ids, user_id)
+        if index < len(self.ids) and self.ids[index] == user_id:
+            return index
+        return -1
+
+    def name_at(self, index):
+        return self.names[self.offsets[index]:self.offsets[index + 1]].decode('utf-8')
+
+
+def _build_main(rows):
+    ids = array('q')
+    offsets = array('Q', [0])
+    names = bytearray()
+    for user_id, name in rows:
+        ids.append(user_id)
+        names += name.encode('utf-8')
+        offsets.append(len(names))
+    return _Main(ids, offsets, bytes(names))
+
+
+class CompactUserTable:
+    """Array-backed id -> name table with a sorted side buffer for writes"""
+
+    def __init__(self, merge_threshold=4096):
+        self.merge_threshold = merge_threshold
+        self.main = _build_main(())
+        self.added = {}
+        self.added_ids = []
+        self.deleted = set()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_rows(cls, rows, merge_threshold=4096):
+        """Build from (id, name) rows in strictly increasing id order"""
+        table = cls(merge_threshold)
+        table.main = _build_main(rows)
+        return table
+
+    def __len__(self):
+        return len(self.main) - len(self.deleted) + len(self.added)
+
+    def get(self, user_id):
+        name = self.added.get(user_id)
+        if name is not None:
+            return name
+        if user_id in self.deleted:
+            return None
+        main = self.main
+        index = main.index_of(user_id)
+        return main.name_at(index) if index >= 0 else None
+
+    def get_many(self, user_ids):
+        main = self.main
+        found = {}
+        pending = []
+        for user_id in user_ids:
+            name = self.added.get(user_id)
+            if name is not None:
+                found[user_id] = name
+            elif user_id not in self.deleted:
+                pending.append(user_id)
+        if not pending or not len(main):
+            return found
+
+        if main.ids_np is not None:
+            wanted = np.asarray(pending, dtype=np.int64)
+            positions = np.searchsorted(main.ids_np, wanted)
+            clipped = np.minimum(positions, len(main) - 1)
+            hits = main.ids_np[clipped] == wanted
+            for user_id, index in zip(wanted[hits].tolist(), clipped[hits].tolist()):
+                found[user_id] = main.name_at(index)
+        else:
+            for user_id in pending:
+                index = main.index_of(user_id)
+                if index >= 0:
+                    found[user_id] = main.name_at(index)
+        return found
+
+    def insert(self, user_id, name):
+        """Add or replace a user"""
+        with self._lock:
+            if user_id not in self.added:
+                bisect.insort(self.added_ids, user_id)
+            self.added[user_id] = name
+            if self.main.index_of(user_id) >= 0:
+                # Shadowed: drop the old copy from the arrays at the next merge
+                self.deleted.add(user_id)
+            self._maybe_merge()
+
+    def delete(self, user_id):
+        with self._lock:
+            if self.added.pop(user_id, None) is not None:
+                del self.added_ids[bisect.bisect_left(self.added_ids, user_id)]
+            if self.main.index_of(user_id) >= 0:
+                self.deleted.add(user_id)
+            self._maybe_merge()
+
+    def _maybe_merge(self):
+        if len(self.added) + len(self.deleted) >= self.merge_threshold:
+            self._merge()
+
+    def merge(self):
+        """Fold the side buffer into the arrays"""
+        with self._lock:
+            self._merge()
+
+    def _merge(self):
+        self.main = _build_main(self._iter_merged(self.main, self.added, self.added_ids, self.deleted))
+        self.added = {}
+        self.added_ids = []
+        self.deleted = set()
+
+    @staticmethod
+    def _iter_merged(main, added, added_ids, deleted, start=0, side_start=0):
+        """Two-way merge of the arrays and the side buffer, skipping deletes"""
+        i, j = start, side_start
+        count, side_count = len(main), len(added_ids)
+        while i < count or j < side_count:
+            if j >= side_count or (i < count and main.ids[i] < added_ids[j]):
+                user_id = main.ids[i]
+                if user_id not in deleted:
+                    yield user_id, main.name_at(i)
+                i += 1
+            else:
+                user_id = added_ids[j]
+                yield user_id, added[user_id]
+                j += 1
+
+    def list_page(self, after_id=None, limit=None):
+        with self._lock:
+            main, added, added_ids, deleted = self.main, dict(self.added), list(self.added_ids), set(self.deleted)
+        start = 0 if after_id is None else bisect.bisect_right(main.ids, after_id)
+        side_start = 0 if after_id is None else bisect.bisect_right(added_ids, after_id)
+        rows = []
+        for row in self._iter_merged(main, added, added_ids, deleted, start, side_start):
+            if limit is not None and len(rows) >= limit:
+                break
+            rows.append(row)
+        return rows
+
+    def memory_usage(self):
+        """Approximate bytes held by the arrays"""
+        main = self.main
+        return (main.ids.itemsize * len(main.ids) + main.offsets.itemsize * len(main.offsets)
+                + len(main.names))
+
+
+class CompactTableStorage(Storage):
+    """Serves reads from a per-worker CompactUserTable, writing through
+
+    Reads go to the backend until load() has run; changes the backend
+    reports (including other workers' writes) are applied to the table,
+    and a 'reload' loads it again.
+    """
+
+    name = 'compact'
+
+    def __init__(self, backend, merge_threshold=4096):
+        self.backend = backend
+        self.merge_threshold = merge_threshold
+        self.table = None
+        self._lock = threading.Lock()
+        self._loading = False
+        self._pending = []
+        # A 'reload' arrived mid-load, which may predate the missed changes
+        self._reload_again = False
+        backend.subscribe(self._on_change)
+
+    def load(self):
+        """(Re)load the whole table from the backend, replaying changes seen meanwhile"""
+        with self._lock:
+            if self._loading:
+                return self.table
+            self._loading = True
+            self._pending = []
+        try:
+            table = CompactUserTable.from_rows(self.backend.export(), self.merge_threshold)
+        except BaseException:
+            with self._lock:
+                self._loading = False
+            raise
+        with self._lock:
+            for op, user_id, name in self._pending:
+                self._apply(table, op, user_id, name)
+            self._pending = []
+            self._loading = False
+            self.table = table
+            reload_again, self._reload_again = self._reload_again, False
+        print(f"Loaded {len(table)} users into compact table "
+              f"({table.memory_usage()} bytes)")
+        if reload_again:
+            return self.load()
+        return table
+
+    @staticmethod
+    def _apply(table, op, user_id, name):
+        if op == 'add':
+            table.insert(user_id, name)
+        elif op == 'delete':
+            table.delete(user_id)
+
+    def _on_change(self, op, user_id, name):
+        if op == 'reload':
+            with self._lock:
+                if self._loading:
+                    self._reload_again = True
+                    return
+            threading.Thread(target=self.load, name='compact-table-load', daemon=True).start()
+            return
+        with self._lock:
+            if self.table is not None:
+                self._apply(self.table, op, user_id, name)
+            if self._loading:
+                self._pending.append((op, user_id, name))
+
+    def initialize(self):
+        self.backend.initialize()
+        self.load()
+
+    def get(self, user_id):
+        if self.table is None:
+            return self.backend.get(user_id)
+        return self.table.get(user_id)
+
+    def get_many(self, user_ids):
+        if self.table is None:
+            return self.backend.get_many(user_ids)
+        return self.table.get_many(user_ids)
+
+    def add_if_absent(self, user_id, name):
+        inserted, existing = self.backend.add_if_absent(user_id, name)
+        if self.table is not None:
+            if inserted:
+                self.table.insert(user_id, name)
+            elif existing is not None:
+                self.table.insert(user_id, existing)
+        return inserted, existing
+
+    def add_many_if_absent(self, rows):
+        outcomes = self.backend.add_many_if_absent(rows)
+        if self.table is not None:
+            for (user_id, name), (inserted, existing) in zip(rows, outcomes):
+                if inserted:
+                    self.table.insert(user_id, name)
+                elif existing is not None:
+                    self.table.insert(user_id, existing)
+        return outcomes
+
+    def delete(self, user_id):
+        deleted = self.backend.delete(user_id)
+        if self.table is not None:
+            self.table.delete(user_id)
+        return deleted
+
+    def list_page(self, after_id=None, limit=None):
+        if self.table is None:
+            return self.backend.list_page(after_id, limit)
+        return self.table.list_page(after_id, limit)
+
+    def bulk_load(self, rows):
+        inserted = self.backend.bulk_load(rows)
+        if self.table is not None:
+            self.load()
+        return inserted
+
+    def export(self):
+        return self.backend.export()
+
+    def lease_id_block(self, size):
+        return self.backend.lease_id_block(size)
+
+    def reserve_ids(self, user_ids, ttl):
+        return self.backend.reserve_ids(user_ids, ttl)
+
+    def ping(self):
+        return self.backend.ping()
+
+    def version(self):
+        return self.backend.version()
+
+    def close(self):
+        self.backend.close()
+
+    def subscribe(self, callback):
+        self.backend.subscribe(callback)
@@ -0,0 +1,67 @@
+"""Per-request latency budgets.
+
+A view runs inside budget(seconds). Storage calls made while it is active
+read remaining() and hand what is left to Postgres as statement_timeout
+and lock_timeout, so no single query can outlive the request that issued
+it. Running out raises DeadlineExceeded and marks the budget exceeded.
+"""
+import contextvars
+import math
+import time
+from contextlib import contextmanager
+
+_current = contextvars.ContextVar('deadline', default=None)
+
+
+class DeadlineExceeded(Exception):
+    """The request's latency budget ran out"""
+
+
+class Budget:
+    __slots__ = ('seconds', 'expires', 'exceeded')
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.expires = time.monotonic() + seconds
+        self.exceeded = False
+
+
+@contextmanager
+def budget(seconds):
+    """Run the block with a budget of `seconds`, yielding the Budget"""
+    current = Budget(seconds)
+    token = _current.set(current)
+    try:
+        yield current
+    finally:
+        _current.reset(token)
+
+
+def remaining():
+    """Seconds left in the current budget, or None outside of one"""
+    current = _current.get()
+    if current is None:
+        return None
+    return current.expires - time.monotonic()
+
+
+def exceeded(message=None):
+    """A DeadlineExceeded to raise, marking the current budget as spent"""
+    current = _current.get()
+    if current is not None:
+        current.exceeded = True
+        message = message or f"Deadline of {current.seconds}s exceeded"
+    return DeadlineExceeded(message or 'Deadline exceeded')
+
+
+def timeout_ms():
+    """Whole milliseconds left for a query, None without a budget
+
+    Raises DeadlineExceeded once nothing is left.
+    """
+    left = remaining()
+    if left is None:
+        return None
+    if left <= 0:
+        raise exceeded()
+    return max(1, math.ceil(left * 1000))
@@ -0,0 +1,99 @@
+"""Rendered-fragment cache for the home page's user rows.
+
+Pages are keyed by their cursor (the id they start after) and size. Each
+cached page remembers the id range it covers, so a change to user X only
+drops the pages whose content X lands in: a page starting after X, or a
+full page ending before X, renders the same as before. A 'reload' drops
+everything by bumping the generation that stamps every entry.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+
+class _Page:
+    __slots__ = ('after_id', 'last_id', 'full', 'html', 'next_after', 'expires')
+
+    def __init__(self, after_id, last_id, full, html, next_after, expires):
+        self.after_id = after_id
+        self.last_id = last_id
+        self.full = full
+        self.html = html
+        self.next_after = next_after
+        self.expires = expires
+
+
+class FragmentCache:
+    """LRU of (after_id, limit) -> rendered rows, invalidated by id range"""
+
+    def __init__(self, ttl=30.0, max_pages=1000):
+        self.ttl = ttl
+        self.max_pages = max_pages
+        self.pages = OrderedDict()
+        # Bumped by every invalidation; a render only caches its page if
+        # nothing was invalidated while it read and rendered
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.ttl > 0 and self.max_pages > 0
+
+    def get(self, after_id, limit):
+        """(html, next_after) for a cached page, or None"""
+        if not self.enabled:
+            return None
+        with self._lock:
+            page = self.pages.get((after_id, limit))
+            if page is None or page.expires <= time.monotonic():
+                self.misses += 1
+                return None
+            self.pages.move_to_end((after_id, limit))
+            self.hits += 1
+            return page.html, page.next_after
+
+    def put(self, after_id, limit, ids, html, next_after, generation):
+        """Cache a page rendered from rows with these ids, read at generation"""
+        if not self.enabled:
+            return
+        full = limit is not None and len(ids) >= limit
+        page = _Page(after_id, ids[-1] if ids else None, full, html, next_after,
+                     time.monotonic() + self.ttl)
+        with self._lock:
+            if generation != self.generation:
+                return
+            self.pages[(after_id, limit)] = page
+            self.pages.move_to_end((after_id, limit))
+            while len(self.pages) > self.max_pages:
+                self.pages.popitem(last=False)
+
+    @staticmethod
+    def _covers(page, user_id):
+        if page.after_id is not None and user_id <= page.after_id:
+            return False
+        return not page.full or user_id <= page.last_id
+
+    def invalidate(self, user_id=None):
+        """Drop pages whose rows user_id falls among, or all pages"""
+        with self._lock:
+            self.generation += 1
+            if user_id is None:
+                self.pages.clear()
+                return
+            for key in [key for key, page in self.pages.items() if self._covers(page, user_id)]:
+                del self.pages[key]
+
+    def on_change(self, op, user_id, name):
+        """Storage.subscribe callback"""
+        self.invalidate(None if op == 'reload' else user_id)
+
+    def stats(self):
+        return {
+            'pages': len(self.pages),
+            'hits': self.hits,
+            'misses': self.misses,
+            'ttl': self.ttl,
+            'max_pages': self.max_pages,
+        }
@@ -0,0 +1,207 @@
+"""Index of unused user ids, kept as sorted free intervals.
+
+Built from one ordered scan of the table and updated from storage change
+notifications, so suggesting fresh ids for the add form is a bisect away
+instead of a guess-and-retry loop against the database.
+"""
+import bisect
+import threading
+import time
+
+from storage import StorageError
+
+MIN_ID = 1
+MAX_ID = 2 ** 31 - 1
+
+
+class FreeIdIndex:
+    """Free ids in [min_id, max_id] as disjoint inclusive intervals
+
+    Suggested ids are held back from other suggestions for reserve_ttl
+    seconds so two forms opened together in this worker do not collide;
+    FreeIdTracker also holds them in the storage for other workers.
+    """
+
+    def __init__(self, min_id=MIN_ID, max_id=MAX_ID, reserve_ttl=60.0):
+        self.min_id = min_id
+        self.max_id = max_id
+        self.reserve_ttl = reserve_ttl
+        self.starts = [min_id]
+        self.ends = [max_id]
+        self.reserved = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_sorted(cls, used_ids, min_id=MIN_ID, max_id=MAX_ID, reserve_ttl=60.0):
+        """Build from used ids in ascending order"""
+        index = cls(min_id, max_id, reserve_ttl)
+        starts, ends = [], []
+        next_free = min_id
+        for user_id in used_ids:
+            if user_id < next_free or user_id > max_id:
+                continue
+            if user_id > next_free:
+                starts.append(next_free)
+                ends.append(user_id - 1)
+            next_free = user_id + 1
+        if next_free <= max_id:
+            starts.append(next_free)
+            ends.append(max_id)
+        index.starts, index.ends = starts, ends
+        return index
+
+    def __contains__(self, user_id):
+        """True if the id is free"""
+        position = bisect.bisect_right(self.starts, user_id) - 1
+        return position >= 0 and user_id <= self.ends[position]
+
+    def _remove(self, user_id):
+        position = bisect.bisect_right(self.starts, user_id) - 1
+        if position < 0 or user_id > self.ends[position]:
+            return False
+        start, end = self.starts[position], self.ends[position]
+        if start == end:
+            del self.starts[position]
+            del self.ends[position]
+        elif user_id == start:
+            self.starts[position] = start + 1
+        elif user_id == end:
+            self.ends[position] = end - 1
+        else:
+            self.ends[position] = user_id - 1
+            self.starts.insert(position + 1, user_id + 1)
+            self.ends.insert(position + 1, end)
+        return True
+
+    def _add(self, user_id):
+        if not self.min_id <= user_id <= self.max_id or user_id in self:
+            return
+        position = bisect.bisect_left(self.starts, user_id)
+        joins_left = position > 0 and self.ends[position - 1] == user_id - 1
+        joins_right = position < len(self.starts) and self.starts[position] == user_id + 1
+        if joins_left and joins_right:
+            self.ends[position - 1] = self.ends[position]
+            del self.starts[position]
+            del self.ends[position]
+        elif joins_left:
+            self.ends[position - 1] = user_id
+        elif joins_right:
+            self.starts[position] = user_id
+        else:
+            self.starts.insert(position, user_id)
+            self.ends.insert(position, user_id)
+
+    def mark_used(self, user_id):
+        with self._lock:
+            self.reserved.pop(user_id, None)
+            self._remove(user_id)
+
+    def mark_free(self, user_id):
+        with self._lock:
+            self.reserved.pop(user_id, None)
+            self._add(user_id)
+
+    def _release_expired(self, now):
+        expired = [user_id for user_id, expires in self.reserved.items() if expires <= now]
+        for user_id in expired:
+            del self.reserved[user_id]
+            self._add(user_id)
+
+    def suggest(self, count=1):
+        """Reserve and return up to count of the lowest free ids"""
+        now = time.monotonic()
+        with self._lock:
+            self._release_expired(now)
+            ids = []
+            while len(ids) < count and self.starts:
+                start = self.starts[0]
+                take = min(count - len(ids), self.ends[0] - start + 1)
+                ids.extend(range(start, start + take))
+                if start + take > self.ends[0]:
+                    del self.starts[0]
+                    del self.ends[0]
+                else:
+                    self.starts[0] = start + take
+            for user_id in ids:
+                self.reserved[user_id] = now + self.reserve_ttl
+        return ids
+
+    def interval_count(self):
+        return len(self.starts)
+
+
+class FreeIdTracker:
+    """Keeps a FreeIdIndex current from a storage backend's changes"""
+
+    def __init__(self, storage, reserve_ttl=60.0):
+        self.storage = storage
+        self.reserve_ttl = reserve_ttl
+        self.index = None
+        self._pending = None
+        self._lock = threading.Lock()
+        storage.subscribe(self._on_change)
+
+    @property
+    def ready(self):
+        return self.index is not None
+
+    def rebuild(self):
+        """Rebuild from one ordered id scan, replaying changes seen meanwhile"""
+        with self._lock:
+            if self._pending is not None:
+                return
+            self._pending = []
+        try:
+            index = FreeIdIndex.from_sorted((user_id for user_id, _ in self.storage.export()),
+                                            reserve_ttl=self.reserve_ttl)
+        except Exception as e:
+            print(f"Free id index rebuild failed: {e}")
+            with self._lock:
+                self._pending = None
+            return
+        with self._lock:
+            for op, user_id in self._pending:
+                self._apply(index, op, user_id)
+            self.index = index
+            self._pending = None
+        print(f"Free id index built: {index.interval_count()} free ranges")
+
+    @staticmethod
+    def _apply(index, op, user_id):
+        if op == 'add':
+            index.mark_used(user_id)
+        elif op == 'delete':
+            index.mark_free(user_id)
+
+    def _on_change(self, op, user_id, name):
+        if op == 'reload':
+            threading.Thread(target=self.rebuild, name='free-ids-rebuild', daemon=True).start()
+            return
+        with self._lock:
+            if self.index is not None:
+                self._apply(self.index, op, user_id)
+            if self._pending is not None:
+                self._pending.append((op, user_id))
+
+    def suggest(self, count=1, attempts=5):
+        """Fresh ids, or an empty list while the index is still building
+
+        Candidates are held in the storage as well, so workers (and nodes)
+        do not suggest the same id; ones another worker holds stay held in
+        this index too and are skipped until their hold lapses.
+        """
+        if self.index is None:
+            return []
+        ids = []
+        for _ in range(attempts):
+            candidates = self.index.suggest(count - len(ids))
+            if not candidates:
+                break
+            try:
+                ids.extend(self.storage.reserve_ids(candidates, self.reserve_ttl))
+            except StorageError as e:
+                print(f"Could not reserve suggested ids: {e}")
+                break
+            if len(ids) >= count:
+                break
+        return ids
@@ -0,0 +1,115 @@
+"""gunicorn settings for the user app (started by serve.py)
+
+    python serve.py
+    gunicorn -c gunicorn.conf.py app:app
+
+Everything is overridable from the environment: WORKER_CLASS (sync,
+gthread, gevent or asgi), WEB_CONCURRENCY, WEB_THREADS, PORT,
+PRELOAD_APP (default on, except for gevent), MAX_REQUESTS,
+MAX_REQUESTS_JITTER, KEEPALIVE, TIMEOUT.
+"""
+import gc
+import os
+
+WORKER_CLASSES = {
+    'sync': 'sync',
+    'gthread': 'gthread',
+    'gevent': 'gevent',
+    'asgi': 'uvicorn.workers.UvicornWorker',
+}
+
+
+def cpu_count():
+    """CPUs this process may actually use, honouring affinity and cgroup quotas"""
+    try:
+        count = len(os.sched_getaffinity(0))
+    except AttributeError:
+        count = os.cpu_count() or 1
+    try:
+        with open('/sys/fs/cgroup/cpu.max') as f:
+            quota, period = f.read().split()
+        if quota != 'max':
+            count = min(count, max(1, int(int(quota) / int(period))))
+    except (OSError, ValueError):
+        pass
+    return count
+
+
+worker_kind = os.environ.get('WORKER_CLASS', 'gthread')
+if worker_kind not in WORKER_CLASSES:
+    raise ValueError(f"WORKER_CLASS must be one of {', '.join(WORKER_CLASSES)}, not {worker_kind!r}")
+worker_class = WORKER_CLASSES[worker_kind]
+
+cpus = cpu_count()
+if worker_kind == 'sync':
+    # One request per process, so enough processes to cover DB waits
+    default_workers, default_threads = 2 * cpus + 1, 1
+elif worker_kind == 'gthread':
+    default_workers, default_threads = cpus + 1, 4
+else:
+    # gevent and asgi multiplex requests inside each process
+    default_workers, default_threads = cpus, 1
+
+workers = int(os.environ.get('WEB_CONCURRENCY', default_workers))
+threads = int(os.environ.get('WEB_THREADS', default_threads))
+worker_connections = int(os.environ.get('WORKER_CONNECTIONS', 1000))
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 10000)}"
+keepalive = int(os.environ.get('KEEPALIVE', 5))
+timeout = int(os.environ.get('TIMEOUT', 30))
+graceful_timeout = timeout
+
+# Recycle workers now and then to bound slow leaks; the jitter keeps them
+# from all restarting at once
+max_requests = int(os.environ.get('MAX_REQUESTS', 10000))
+max_requests_jitter = int(os.environ.get('MAX_REQUESTS_JITTER', max_requests // 10))
+
+# Import the app once in the master and fork it into the workers. Not by
+# default for gevent: the master would import the app before the worker
+# monkey-patches, leaving its module-level locks and conditions real OS
+# primitives that block the whole hub
+preload_app = os.environ.get('PRELOAD_APP', '0' if worker_kind == 'gevent' else '1') == '1'
+if preload_app:
+    # Tells app.py to leave per-worker startup to post_fork
+    os.environ['GUNICORN_PRELOAD'] = '1'
+    # No collections in the master while the app loads, so the objects it
+    # leaves behind are not scattered over pages the workers would then copy
+    gc.disable()
+
+
+def when_ready(server):
+    """Create the schema and warm the preloaded app once, before any worker is forked"""
+    from storage import StorageUnavailable, get_storage
+
+    storage = get_storage()
+    try:
+        storage.initialize()
+    except StorageUnavailable:
+        server.log.warning("Database initialization failed; workers will retry lazily")
+    except Exception as e:
+        server.log.warning(f"Database initialization error: {e}")
+    finally:
+        storage.close()
+
+    if preload_app:
+        import app
+        app.warm_master()
+        # Move everything built so far out of the collector's reach: the
+        # workers' collections then never write to (and un-share) its pages
+        gc.freeze()
+        # The master lives as long as the workers; it needs collections too
+        gc.enable()
+
+
+def pre_fork(server, worker):
+    """Freeze whatever the master allocated since the last fork too"""
+    if preload_app:
+        gc.freeze()
+
+
+def post_fork(server, worker):
+    """Give each preloaded worker its own pool, listener and caches"""
+    if preload_app:
+        gc.enable()
+        import app
+        app.post_fork()
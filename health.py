@@ -0,0 +1,69 @@
+"""Cached readiness reporting.
+
+A background thread pings the database through the pool every interval
+seconds and keeps the outcome, so /readyz and /health answer from memory
+however often load balancers probe them.
+"""
+import threading
+import time
+
+from breaker import OPEN
+
+
+class ReadinessChecker:
+    """Periodic storage ping plus pool and breaker state, served from cache"""
+
+    def __init__(self, storage, database, interval=2.0):
+        self.storage = storage
+        self.database = database
+        self.interval = interval
+        self.database_ok = None
+        self.ping_ms = None
+        self.checked_at = None
+        # Set while the worker warms up; not ready until it is cleared
+        self.warming = False
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def ensure_started(self):
+        # Started on first use, so a pre-fork parent never owns the thread
+        if self._thread is None or not self._thread.is_alive():
+            with self._lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(target=self._run, name='readiness', daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        while True:
+            self.check()
+            time.sleep(self.interval)
+
+    def check(self):
+        started = time.monotonic()
+        ok = self.storage.ping()
+        self.ping_ms = round((time.monotonic() - started) * 1000, 3)
+        self.database_ok = ok
+        self.checked_at = time.time()
+
+    def report(self):
+        """(ready, details) from the last check; never does I/O itself"""
+        self.ensure_started()
+        stats = self.database.stats()
+        age = time.time() - self.checked_at if self.checked_at is not None else None
+        # A result older than a few intervals means the checker is stuck
+        fresh = age is not None and age < 3 * self.interval + 5
+        breaker_open = stats.get('breaker', {}).get('state') == OPEN
+        ready = bool(self.database_ok) and fresh and not breaker_open and not self.warming
+        if self.database_ok is None:
+            database = 'unknown'
+        else:
+            database = 'connected' if self.database_ok else 'disconnected'
+        details = {
+            'ready': ready,
+            'warming': self.warming,
+            'database': database,
+            'ping_ms': self.ping_ms,
+            'checked_seconds_ago': round(age, 3) if age is not None else None,
+        }
+        details.update(stats)
+        return ready, details
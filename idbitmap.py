@@ -0,0 +1,313 @@
+"""Compressed bitmap of the user ids present in the users table.
+
+Roaring-style layout: ids are shifted into the uint32 range and split into
+a 16-bit chunk key and a 16-bit low part. Each chunk is a sorted
+array('H') while it holds at most 4096 ids and an 8 KiB bitmap after that,
+so sparse and dense id ranges both stay small.
+
+IdIndex keeps one bitmap per worker current from storage change
+notifications and can save it to disk for a fast warm start.
+"""
+import bisect
+import os
+import struct
+import sys
+import tempfile
+import threading
+import time
+from array import array
+
+ID_OFFSET = 2 ** 31
+ARRAY_MAX = 4096
+BITMAP_BYTES = 8192
+
+MAGIC = b'UIDBMP01'
+FILE_HEADER = struct.Struct('<8sdI')
+CHUNK_HEADER = struct.Struct('<HBI')
+KIND_ARRAY = 0
+KIND_BITMAP = 1
+
+
+def _split(user_id):
+    key = user_id + ID_OFFSET
+    if not 0 <= key < 2 ** 32:
+        return None, None
+    return key >> 16, key & 0xFFFF
+
+
+def _write_atomic(path, data):
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix='.id-bitmap-', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+def _to_bitmap(values):
+    bits = bytearray(BITMAP_BYTES)
+    for low in values:
+        bits[low >> 3] |= 1 << (low & 7)
+    return bits
+
+
+def _to_array(bits):
+    values = array('H')
+    for index, byte in enumerate(bits):
+        while byte:
+            bit = byte & -byte
+            values.append(index * 8 + bit.bit_length() - 1)
+            byte ^= bit
+    return values
+
+
+class IdBitmap:
+    """Set of integer ids in chunked array/bitmap containers"""
+
+    def __init__(self):
+        self.chunks = {}
+        self.counts = {}
+
+    @classmethod
+    def from_sorted(cls, user_ids):
+        """Build from ids in ascending order without per-id container churn"""
+        bitmap = cls()
+        current_high = None
+        lows = array('H')
+        for user_id in user_ids:
+            high, low = _split(user_id)
+            if high is None:
+                continue
+            if high != current_high:
+                if current_high is not None:
+                    bitmap._set_chunk(current_high, lows)
+                current_high = high
+                lows = array('H')
+            lows.append(low)
+        if current_high is not None:
+            bitmap._set_chunk(current_high, lows)
+        return bitmap
+
+    def _set_chunk(self, high, lows):
+        self.counts[high] = len(lows)
+        self.chunks[high] = lows if len(lows) <= ARRAY_MAX else _to_bitmap(lows)
+
+    def __len__(self):
+        return sum(self.counts.values())
+
+    def __contains__(self, user_id):
+        high, low = _split(user_id)
+        chunk = self.chunks.get(high)
+        if chunk is None:
+            return False
+        if isinstance(chunk, bytearray):
+            return bool(chunk[low >> 3] & (1 << (low & 7)))
+        index = bisect.bisect_left(chunk, low)
+        return index < len(chunk) and chunk[index] == low
+
+    def add(self, user_id):
+        high, low = _split(user_id)
+        if high is None:
+            return
+        chunk = self.chunks.get(high)
+        if chunk is None:
+            self.chunks[high] = array('H', [low])
+            self.counts[high] = 1
+        elif isinstance(chunk, bytearray):
+            mask = 1 << (low & 7)
+            if not chunk[low >> 3] & mask:
+                chunk[low >> 3] |= mask
+                self.counts[high] += 1
+        else:
+            index = bisect.bisect_left(chunk, low)
+            if index < len(chunk) and chunk[index] == low:
+                return
+            chunk.insert(index, low)
+            self.counts[high] += 1
+            if len(chunk) > ARRAY_MAX:
+                self.chunks[high] = _to_bitmap(chunk)
+
+    def discard(self, user_id):
+        high, low = _split(user_id)
+        chunk = self.chunks.get(high)
+        if chunk is None:
+            return
+        if isinstance(chunk, bytearray):
+            mask = 1 << (low & 7)
+            if not chunk[low >> 3] & mask:
+                return
+            chunk[low >> 3] &= ~mask
+            self.counts[high] -= 1
+            if self.counts[high] <= ARRAY_MAX:
+                self.chunks[high] = _to_array(chunk)
+        else:
+            index = bisect.bisect_left(chunk, low)
+            if index >= len(chunk) or chunk[index] != low:
+                return
+            del chunk[index]
+            self.counts[high] -= 1
+        if not self.counts[high]:
+            del self.chunks[high]
+            del self.counts[high]
+
+    def memory_usage(self):
+        """Approximate container bytes"""
+        return sum(len(chunk) if isinstance(chunk, bytearray) else 2 * len(chunk)
+                   for chunk in self.chunks.values())
+
+    def to_bytes(self, saved_at=None):
+        parts = [FILE_HEADER.pack(MAGIC, saved_at or time.time(), len(self.chunks))]
+        for high in sorted(self.chunks):
+            chunk = self.chunks[high]
+            if isinstance(chunk, bytearray):
+                parts.append(CHUNK_HEADER.pack(high, KIND_BITMAP, self.counts[high]))
+                parts.append(bytes(chunk))
+            else:
+                values = array('H', chunk)
+                if sys.byteorder != 'little':
+                    values.byteswap()
+                parts.append(CHUNK_HEADER.pack(high, KIND_ARRAY, len(values)))
+                parts.append(values.tobytes())
+        return b''.join(parts)
+
+    @classmethod
+    def from_bytes(cls, data):
+        """Returns (bitmap, saved_at)"""
+        magic, saved_at, chunk_count = FILE_HEADER.unpack_from(data, 0)
+        if magic != MAGIC:
+            raise ValueError('Not an id bitmap file')
+        bitmap = cls()
+        pos = FILE_HEADER.size
+        for _ in range(chunk_count):
+            high, kind, count = CHUNK_HEADER.unpack_from(data, pos)
+            pos += CHUNK_HEADER.size
+            if kind == KIND_BITMAP:
+                bitmap.chunks[high] = bytearray(data[pos:pos + BITMAP_BYTES])
+                pos += BITMAP_BYTES
+            else:
+                values = array('H')
+                values.frombytes(data[pos:pos + 2 * count])
+                if sys.byteorder != 'little':
+                    values.byteswap()
+                bitmap.chunks[high] = values
+                pos += 2 * count
+            bitmap.counts[high] = count
+        return bitmap, saved_at
+
+    def save(self, path):
+        """Write atomically to path"""
+        _write_atomic(path, self.to_bytes())
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            return cls.from_bytes(f.read())
+
+
+class IdIndex:
+    """Per-worker bitmap of present ids kept current from storage changes
+
+    Until the first load or build finishes, ready is False and callers
+    must fall back to the database. A bitmap loaded from disk, or one that
+    may have missed changes (after a 'reload'), can lack ids added since:
+    it answers probably_present, but definitely_absent stays False until
+    a full scan has reconciled it (complete is True).
+    """
+
+    def __init__(self, storage, path=None, max_age=300.0):
+        self.storage = storage
+        self.path = path
+        self.max_age = max_age
+        self.bitmap = IdBitmap()
+        self.ready = False
+        self.complete = False
+        self._lock = threading.Lock()
+        self._rebuilding = False
+        # A 'reload' arrived mid-scan, which may predate the missed changes
+        self._rescan = False
+        self._pending = []
+        storage.subscribe(self._on_change)
+
+    def start(self):
+        """Warm start from disk if the file is fresh, then reconcile in the background"""
+        if self.path and os.path.exists(self.path):
+            try:
+                bitmap, saved_at = IdBitmap.load(self.path)
+                if time.time() - saved_at <= self.max_age:
+                    with self._lock:
+                        self.bitmap = bitmap
+                        self.ready = True
+                    print(f"Loaded id bitmap from {self.path}: {len(bitmap)} ids")
+            except (OSError, ValueError, struct.error) as e:
+                print(f"Could not load id bitmap {self.path}: {e}")
+        if self.ready:
+            threading.Thread(target=self.rebuild, name='id-bitmap-rebuild', daemon=True).start()
+        else:
+            self.rebuild()
+
+    def rebuild(self):
+        """Rebuild from a full id scan, replaying changes seen meanwhile"""
+        with self._lock:
+            if self._rebuilding:
+                return
+            self._rebuilding = True
+            self._pending = []
+        try:
+            bitmap = IdBitmap.from_sorted(user_id for user_id, _ in self.storage.export())
+        except Exception as e:
+            print(f"Id bitmap rebuild failed: {e}")
+            with self._lock:
+                self._rebuilding = False
+            return
+        with self._lock:
+            for op, user_id in self._pending:
+                self._apply(bitmap, op, user_id)
+            self.bitmap = bitmap
+            self.ready = True
+            rescan, self._rescan = self._rescan, False
+            self.complete = not rescan
+            self._rebuilding = False
+            self._pending = []
+        print(f"Id bitmap built: {len(bitmap)} ids, {bitmap.memory_usage()} bytes")
+        if rescan:
+            self.rebuild()
+
+    @staticmethod
+    def _apply(bitmap, op, user_id):
+        if op == 'add':
+            bitmap.add(user_id)
+        elif op == 'delete':
+            bitmap.discard(user_id)
+
+    def _on_change(self, op, user_id, name):
+        if op == 'reload':
+            with self._lock:
+                self.complete = False
+                if self._rebuilding:
+                    self._rescan = True
+                    return
+            threading.Thread(target=self.rebuild, name='id-bitmap-rebuild', daemon=True).start()
+            return
+        with self._lock:
+            self._apply(self.bitmap, op, user_id)
+            if self._rebuilding:
+                self._pending.append((op, user_id))
+
+    def definitely_absent(self, user_id):
+        """True when the id is not in the table, as far as this worker has heard"""
+        return self.complete and user_id not in self.bitmap
+
+    def probably_present(self, user_id):
+        """True when the id is in the table as far as this worker has heard"""
+        return self.ready and user_id in self.bitmap
+
+    def save(self):
+        """Persist the bitmap for the next warm start"""
+        if self.path and self.ready:
+            with self._lock:
+                data = self.bitmap.to_bytes()
+            _write_atomic(self.path, data)
@@ -0,0 +1,197 @@
+import os
+import threading
+import tracemalloc
+
+# Named snapshots taken through the admin endpoints
+_snapshots = {}
+_lock = threading.Lock()
+
+# Per-route allocation counters (route rule -> stats dict)
+_route_stats = {}
+_route_tracking = False
+
+
+def start(nframes=1):
+    """Start tracemalloc if it is not already tracing"""
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(nframes)
+        print(f"tracemalloc started ({nframes} frame(s))")
+    return status()
+
+
+def stop():
+    """Stop tracemalloc and drop all snapshots and route counters"""
+    global _route_tracking
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
+        print("tracemalloc stopped")
+    with _lock:
+        _snapshots.clear()
+        _route_stats.clear()
+        _route_tracking = False
+    return status()
+
+
+def status():
+    """Current tracing state"""
+    current, peak = tracemalloc.get_traced_memory() if tracemalloc.is_tracing() else (0, 0)
+    with _lock:
+        names = sorted(_snapshots)
+    return {
+        'tracing': tracemalloc.is_tracing(),
+        'traced_current_bytes': current,
+        'traced_peak_bytes': peak,
+        'snapshots': names,
+        'route_tracking': _route_tracking,
+    }
+
+
+def take_snapshot(name):
+    """Take a named snapshot, replacing any previous one with the same name"""
+    if not tracemalloc.is_tracing():
+        raise RuntimeError('tracemalloc is not running')
+    snapshot = tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+        tracemalloc.Filter(False, '<unknown>'),
+    ))
+    with _lock:
+        _snapshots[name] = snapshot
+    total = sum(stat.size for stat in snapshot.statistics('filename'))
+    print(f"Memory snapshot '{name}' taken: {total} bytes traced")
+    return {'name': name, 'traced_bytes': total}
+
+
+def diff(old_name, new_name, limit=20, key_type='lineno'):
+    """Top allocation sites that grew between two named snapshots"""
+    with _lock:
+        old = _snapshots.get(old_name)
+        new = _snapshots.get(new_name)
+    if old is None or new is None:
+        missing = old_name if old is None else new_name
+        raise KeyError(f"Unknown snapshot: {missing}")
+
+    stats = new.compare_to(old, key_type)
+    top = []
+    for stat in stats[:limit]:
+        frame = stat.traceback[0]
+        top.append({
+            'site': f"{frame.filename}:{frame.lineno}",
+            'size_diff_bytes': stat.size_diff,
+            'size_bytes': stat.size,
+            'count_diff': stat.count_diff,
+            'count': stat.count,
+        })
+    return {
+        'from': old_name,
+        'to': new_name,
+        'total_diff_bytes': sum(stat.size_diff for stat in stats),
+        'top': top,
+    }
+
+
+def enable_route_tracking():
+    """Start attributing traced allocations to routes"""
+    global _route_tracking
+    start()
+    _route_tracking = True
+    return status()
+
+
+def request_started():
+    """Traced memory at the start of a request, or None when not tracking"""
+    if not _route_tracking or not tracemalloc.is_tracing():
+        return None
+    return tracemalloc.get_traced_memory()[0]
+
+
+def request_finished(route, started_bytes):
+    """Record the net traced allocation of one request against its route
+
+    Concurrent requests in the same worker share the tracemalloc counter,
+    so under threaded workers the numbers are an approximation.
+    """
+    if started_bytes is None or not tracemalloc.is_tracing():
+        return
+    delta = tracemalloc.get_traced_memory()[0] - started_bytes
+    with _lock:
+        stats = _route_stats.setdefault(route, {
+            'requests': 0,
+            'net_bytes': 0,
+            'max_request_bytes': 0,
+        })
+        stats['requests'] += 1
+        stats['net_bytes'] += delta
+        stats['max_request_bytes'] = max(stats['max_request_bytes'], delta)
+
+
+def route_report():
+    """Per-route allocation counters, biggest net growth first"""
+    with _lock:
+        rows = [dict(route=route, **stats) for route, stats in _route_stats.items()]
+    for row in rows:
+        row['avg_request_bytes'] = row['net_bytes'] // row['requests'] if row['requests'] else 0
+    rows.sort(key=lambda row: row['net_bytes'], reverse=True)
+    return rows
+
+
+# smaps_rollup fields reported per process, in kB
+_SMAPS_FIELDS = ('Rss', 'Pss', 'Shared_Clean', 'Shared_Dirty', 'Private_Clean', 'Private_Dirty')
+
+
+def process_memory(pid):
+    """RSS of one process split into shared and private kB (Linux only)"""
+    values = {}
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            key, _, rest = line.partition(':')
+            if key in _SMAPS_FIELDS:
+                values[key] = int(rest.split()[0])
+    return {
+        'pid': pid,
+        'rss_kb': values.get('Rss', 0),
+        'pss_kb': values.get('Pss', 0),
+        'shared_kb': values.get('Shared_Clean', 0) + values.get('Shared_Dirty', 0),
+        'private_kb': values.get('Private_Clean', 0) + values.get('Private_Dirty', 0),
+    }
+
+
+def child_pids(pid):
+    """Direct children of pid, from /proc"""
+    children = []
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                # ppid is the second field after the parenthesised command
+                ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        if ppid == pid:
+            children.append(int(entry))
+    return sorted(children)
+
+
+def worker_memory_report(master_pid):
+    """Shared vs private memory of a gunicorn master and each of its workers
+
+    private_kb is what each extra worker really costs; shared_kb is what
+    it still shares copy-on-write with the master and its siblings.
+    """
+    master = process_memory(master_pid)
+    workers = []
+    for pid in child_pids(master_pid):
+        try:
+            workers.append(process_memory(pid))
+        except OSError:
+            continue  # exited meanwhile
+    count = len(workers)
+    return {
+        'master': master,
+        'workers': workers,
+        'worker_count': count,
+        'avg_worker_private_kb': sum(w['private_kb'] for w in workers) // count if count else 0,
+        'avg_worker_shared_kb': sum(w['shared_kb'] for w in workers) // count if count else 0,
+        'total_pss_kb': master['pss_kb'] + sum(w['pss_kb'] for w in workers),
+    }
@@ -0,0 +1,126 @@
+"""Per-worker metrics in the Prometheus text format.
+
+Counters, gauges and histograms are registered at import time by the
+modules that update them and rendered by the /metrics route. Values are
+per process: under gunicorn a scrape sees whichever worker answered it.
+"""
+import bisect
+import threading
+
+# Seconds; covers queue waits and request latencies from 1ms to 10s
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_registry = []
+_lock = threading.Lock()
+
+
+def _label_text(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{value}"' for key, value in sorted(labels.items())) + '}'
+
+
+class Counter:
+    """Monotonic count, optionally split by one set of label values"""
+
+    kind = 'counter'
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self.values = {}
+        self._lock = threading.Lock()
+        register(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self.values.get(tuple(sorted(labels.items())), 0)
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, dict(key), value) for key, value in self.values.items()]
+
+
+class Gauge:
+    """Current value, set directly or read from a callback at render time"""
+
+    kind = 'gauge'
+
+    def __init__(self, name, help_text, callback=None):
+        self.name = name
+        self.help = help_text
+        self.callback = callback
+        self.current = 0
+        register(self)
+
+    def set(self, value):
+        self.current = value
+
+    def inc(self, amount=1):
+        self.current += amount
+
+    def dec(self, amount=1):
+        self.current -= amount
+
+    def samples(self):
+        value = self.callback() if self.callback is not None else self.current
+        return [(self.name, {}, value)]
+
+
+class Histogram:
+    """Cumulative bucket counts, sum and count of observed values"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+        register(self)
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def samples(self):
+        with self._lock:
+            counts = list(self.counts)
+            total, count = self.sum, self.count
+        samples = []
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets, counts):
+            cumulative += bucket_count
+            samples.append((self.name + '_bucket', {'le': repr(bound)}, cumulative))
+        samples.append((self.name + '_bucket', {'le': '+Inf'}, count))
+        samples.append((self.name + '_sum', {}, total))
+        samples.append((self.name + '_count', {}, count))
+        return samples
+
+
+def register(metric):
+    with _lock:
+        _registry.append(metric)
+
+
+def render():
+    """All registered metrics in the Prometheus text exposition format"""
+    lines = []
+    with _lock:
+        metrics = list(_registry)
+    for metric in metrics:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for name, labels, value in metric.samples():
+            lines.append(f"{name}{_label_text(labels)} {value}")
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,23 @@
+"""Production entry point: gunicorn configured by gunicorn.conf.py
+
+    python serve.py [extra gunicorn options]
+
+Serves app:app, or the ASGI wrapper in asgi.py when WORKER_CLASS=asgi.
+`python app.py` still runs Flask's development server.
+"""
+import os
+import sys
+
+from gunicorn.app.wsgiapp import run
+
+CONFIG = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'gunicorn.conf.py')
+
+
+def main():
+    target = 'asgi:application' if os.environ.get('WORKER_CLASS') == 'asgi' else 'app:app'
+    sys.argv = [sys.argv[0], '-c', CONFIG] + sys.argv[1:] + [target]
+    run()
+
+
+if __name__ == '__main__':
+    main()
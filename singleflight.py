@@ -0,0 +1,75 @@
+"""Per-key request coalescing.
+
+The first caller for a key runs the function; callers arriving while it is
+in flight wait for and share its result (or exception) instead of running
+the same query again, within their own request deadlines.
+"""
+import threading
+
+import deadlines
+
+
+class _Call:
+    __slots__ = ('done', 'result', 'error', 'waiters')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Coalesces concurrent calls for the same key across threads"""
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.executed = 0
+        self.coalesced = 0
+
+    def do(self, key, fn):
+        """fn()'s result, shared with concurrent callers for the same key
+
+        Followers wait no longer than their own deadline. If the leader
+        failed only because its deadline ran out, a follower with time
+        left runs the call again rather than failing too.
+        """
+        while True:
+            with self._lock:
+                call = self._calls.get(key)
+                leader = call is None
+                if leader:
+                    call = self._calls[key] = _Call()
+                    self.executed += 1
+                else:
+                    call.waiters += 1
+                    self.coalesced += 1
+            if leader:
+                break
+            left = deadlines.remaining()
+            if not call.done.wait(None if left is None else max(left, 0.0)):
+                raise deadlines.exceeded()
+            if isinstance(call.error, deadlines.DeadlineExceeded):
+                left = deadlines.remaining()
+                if left is None or left > 0:
+                    continue
+                raise deadlines.exceeded(str(call.error))
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def in_flight(self):
+        return len(self._calls)
+
@@ -0,0 +1,304 @@
+"""Read-only, memory-mapped snapshot of the users table.
+
+File layout (little endian):
+
+    header   magic(8) count(u64) names_size(u64) exported_at(f64)
+    ids      int64[count], sorted ascending
+    offsets  uint64[count + 1], name i is names[offsets[i]:offsets[i + 1]]
+    names    UTF-8 bytes
+
+Every worker maps the same file, so the pages are shared through the page
+cache. Rebuilds write a temporary file and rename it over the old one;
+readers notice the new inode and remap.
+"""
+import bisect
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import threading
+import time
+from array import array
+
+from storage import Storage
+
+MAGIC = b'USNAP001'
+HEADER = struct.Struct('<8sQQd')
+
+# Marks an id deleted in the overlay
+TOMBSTONE = object()
+
+
+def build_snapshot(rows, path):
+    """Write (id, name) rows, in id order, to path atomically; returns the count"""
+    exported_at = time.time()
+    ids = array('q')
+    offsets = array('Q', [0])
+    names = bytearray()
+    last_id = None
+    for user_id, name in rows:
+        if last_id is not None and user_id <= last_id:
+            raise ValueError('Snapshot rows must be in strictly increasing id order')
+        last_id = user_id
+        ids.append(user_id)
+        names += name.encode('utf-8')
+        offsets.append(len(names))
+
+    if ids.itemsize != 8 or offsets.itemsize != 8:
+        raise RuntimeError('Platform lacks 8-byte array types')
+    if sys.byteorder != 'little':
+        ids.byteswap()
+        offsets.byteswap()
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix='.users-snapshot-', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, len(ids), len(names), exported_at))
+            f.write(ids.tobytes())
+            f.write(offsets.tobytes())
+            f.write(names)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+    print(f"Snapshot written to {path}: {len(ids)} users, {len(names)} name bytes")
+    return len(ids)
+
+
+class Snapshot:
+    """One mapped snapshot file"""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.inode = os.fstat(f.fileno()).st_ino
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, count, names_size, self.exported_at = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a user snapshot")
+        if sys.byteorder != 'little':
+            raise RuntimeError('Snapshots are only readable on little-endian hosts')
+
+        view = memoryview(self.map)
+        ids_start = HEADER.size
+        offsets_start = ids_start + 8 * count
+        names_start = offsets_start + 8 * (count + 1)
+        self.count = count
+        self.ids = view[ids_start:offsets_start].cast('q')
+        self.offsets = view[offsets_start:names_start].cast('Q')
+        self.names = view[names_start:names_start + names_size]
+
+    def __len__(self):
+        return self.count
+
+    def _name_at(self, index):
+        return str(self.names[self.offsets[index]:self.offsets[index + 1]], 'utf-8')
+
+    def get(self, user_id):
+        index = bisect.bisect_left(self.ids, user_id)
+        if index < self.count and self.ids[index] == user_id:
+            return self._name_at(index)
+        return None
+
+    def get_many(self, user_ids):
+        """Lookups in id order, narrowing the search window as we go"""
+        found = {}
+        low = 0
+        for user_id in sorted(set(user_ids)):
+            index = bisect.bisect_left(self.ids, user_id, low)
+            if index < self.count and self.ids[index] == user_id:
+                found[user_id] = self._name_at(index)
+            low = index
+        return found
+
+
+class SnapshotStorage(Storage):
+    """Answers reads from a mapped snapshot plus an overlay of recent writes
+
+    Writes go straight to the wrapped backend and are recorded in the
+    overlay, as are other workers' writes the backend reports, so reads
+    see them before the next rebuild. After a 'reload' (changes may have
+    been missed) reads go to the backend until a newer snapshot, rebuilt
+    right away by whichever process gets there first, is loaded.
+    """
+
+    name = 'snapshot'
+
+    def __init__(self, backend, path, refresh_interval=1.0):
+        self.backend = backend
+        self.path = path
+        self.refresh_interval = refresh_interval
+        self.snapshot = None
+        self.overlay = {}
+        self._overlay_times = {}
+        self._lock = threading.Lock()
+        self._next_check = 0.0
+        # Snapshots exported before this time may be missing changes
+        self._stale_before = 0.0
+        backend.subscribe(self._on_change)
+
+    def refresh(self, force=False):
+        """Remap the snapshot if the file was replaced since we last looked"""
+        now = time.monotonic()
+        if not force and now < self._next_check:
+            return self.snapshot
+        self._next_check = now + self.refresh_interval
+
+        try:
+            inode = os.stat(self.path).st_ino
+        except FileNotFoundError:
+            return self.snapshot
+        if self.snapshot is not None and self.snapshot.inode == inode:
+            return self.snapshot
+
+        try:
+            snapshot = Snapshot(self.path)
+        except (OSError, ValueError) as e:
+            print(f"Could not load snapshot {self.path}: {e}")
+            return self.snapshot
+
+        with self._lock:
+            # Writes made after the export started may be missing from it
+            for user_id, written_at in list(self._overlay_times.items()):
+                if written_at < snapshot.exported_at:
+                    del self._overlay_times[user_id]
+                    self.overlay.pop(user_id, None)
+            # The old map is released once no request holds a view of it
+            self.snapshot = snapshot
+        print(f"Loaded user snapshot: {len(snapshot)} users")
+        return snapshot
+
+    def rebuild(self):
+        """Export the backend into a new snapshot file and switch to it"""
+        count = build_snapshot(self.backend.export(), self.path)
+        self.refresh(force=True)
+        return count
+
+    def current(self):
+        """The mapped snapshot, or None if there is none we can trust"""
+        snapshot = self.refresh()
+        if snapshot is None or snapshot.exported_at < self._stale_before:
+            return None
+        return snapshot
+
+    def _on_change(self, op, user_id, name):
+        if op == 'reload':
+            with self._lock:
+                self._stale_before = time.time()
+                self.overlay.clear()
+                self._overlay_times.clear()
+            print("User snapshot is stale, reading from the database until it is rebuilt")
+            threading.Thread(target=self.rebuild_if_stale, name='snapshot-rebuild', daemon=True).start()
+        elif op == 'add':
+            self.record(user_id, name)
+        elif op == 'delete':
+            self.record(user_id, None)
+
+    def rebuild_if_stale(self):
+        """Rebuild after a 'reload', unless another process already has"""
+        snapshot = self.refresh(force=True)
+        if snapshot is not None and snapshot.exported_at >= self._stale_before:
+            return None
+        try:
+            return self.rebuild()
+        except Exception as e:
+            print(f"Snapshot rebuild failed: {e}")
+            return None
+
+    def rebuild_if_older(self, max_age):
+        """Rebuild unless another process did so in the last max_age seconds
+
+        Returns the new count, or None if the file was fresh enough.
+        """
+        try:
+            age = time.time() - os.stat(self.path).st_mtime
+        except FileNotFoundError:
+            age = None
+        if age is not None and age < max_age and self.current() is not None:
+            return None
+        return self.rebuild()
+
+    def record(self, user_id, name):
+        """Note a write (name=None for a delete) made since the snapshot"""
+        with self._lock:
+            self.overlay[user_id] = TOMBSTONE if name is None else name
+            self._overlay_times[user_id] = time.time()
+
+    def initialize(self):
+        self.backend.initialize()
+        self.refresh(force=True)
+
+    def get(self, user_id):
+        snapshot = self.current()
+        if snapshot is None:
+            return self.backend.get(user_id)
+        name = self.overlay.get(user_id)
+        if name is not None:
+            return None if name is TOMBSTONE else name
+        return snapshot.get(user_id)
+
+    def get_many(self, user_ids):
+        snapshot = self.current()
+        if snapshot is None:
+            return self.backend.get_many(user_ids)
+        found = {}
+        misses = []
+        for user_id in user_ids:
+            name = self.overlay.get(user_id)
+            if name is None:
+                misses.append(user_id)
+            elif name is not TOMBSTONE:
+                found[user_id] = name
+        found.update(snapshot.get_many(misses))
+        return found
+
+    def add_if_absent(self, user_id, name):
+        inserted, existing = self.backend.add_if_absent(user_id, name)
+        if inserted or existing is not None:
+            self.record(user_id, name if inserted else existing)
+        return inserted, existing
+
+    def add_many_if_absent(self, rows):
+        outcomes = self.backend.add_many_if_absent(rows)
+        for (user_id, name), (inserted, existing) in zip(rows, outcomes):
+            if inserted or existing is not None:
+                self.record(user_id, name if inserted else existing)
+        return outcomes
+
+    def delete(self, user_id):
+        deleted = self.backend.delete(user_id)
+        self.record(user_id, None)
+        return deleted
+
+    def list_page(self, after_id=None, limit=None):
+        return self.backend.list_page(after_id, limit)
+
+    def bulk_load(self, rows):
+        # Reported as a 'reload', so reads bypass the snapshot until a rebuild
+        return self.backend.bulk_load(rows)
+
+    def export(self):
+        return self.backend.export()
+
+    def lease_id_block(self, size):
+        return self.backend.lease_id_block(size)
+
+    def reserve_ids(self, user_ids, ttl):
+        return self.backend.reserve_ids(user_ids, ttl)
+
+    def ping(self):
+        return self.backend.ping()
+
+    def version(self):
+        return self.backend.version()
+
+    def close(self):
+        self.backend.close()
+
+    def subscribe(self, callback):
+        self.backend.subscribe(callback)
@@ -0,0 +1,1275 @@
+import bisect
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg
+
+import deadlines
+from breaker import CircuitBreaker, CircuitOpen
+
+try:
+    from psycopg_pool import ConnectionPool
+except ImportError:  # pragma: no cover - pool is optional
+    ConnectionPool = None
+
+try:
+    import mysql.connector
+    import mysql.connector.pooling
+except ImportError:  # pragma: no cover - only needed for the MySQL backend
+    mysql = None
+
+
+class StorageError(Exception):
+    """Base class for storage failures"""
+
+
+class StorageUnavailable(StorageError):
+    """The backing database could not be reached"""
+
+    def __init__(self, message='', retry_after=None):
+        super().__init__(message)
+        # Seconds until it is worth trying again, when known
+        self.retry_after = retry_after
+
+
+class ConnectDeadlineExceeded(deadlines.DeadlineExceeded):
+    """The deadline ran out while waiting for a connection
+
+    Unlike a slow query, this says the database may be unreachable, so it
+    counts against the circuit breaker.
+    """
+
+
+def connect_timeout():
+    """Seconds to wait for a new Postgres connection (PG_CONNECT_TIMEOUT)"""
+    return int(os.environ.get('PG_CONNECT_TIMEOUT', 3))
+
+
+class Storage:
+    """Interface implemented by every user storage backend
+
+    Users are (id, name) pairs with integer ids. Listing and export are
+    always ordered by id.
+    """
+
+    name = 'base'
+
+    # Whether every worker's subscribers hear about every other worker's
+    # writes; indexes that answer "absent" on their own need this
+    shares_changes = False
+
+    def initialize(self):
+        """Create the users table if needed"""
+        raise NotImplementedError
+
+    def get(self, user_id):
+        """Name of the user, or None"""
+        raise NotImplementedError
+
+    def get_many(self, user_ids):
+        """Dict of id -> name for the ids that exist"""
+        raise NotImplementedError
+
+    def add_if_absent(self, user_id, name):
+        """Insert a user unless the id is taken
+
+        Returns (True, None) when inserted and (False, existing_name) when
+        the id already exists.
+        """
+        raise NotImplementedError
+
+    def add_many_if_absent(self, rows):
+        """add_if_absent for many (id, name) rows with distinct ids
+
+        Backends commit the whole batch in one transaction. Returns one
+        (inserted, existing_name) outcome per row, in order.
+        """
+        return [self.add_if_absent(user_id, name) for user_id, name in rows]
+
+    def delete(self, user_id):
+        """Delete a user, returning True if a row was removed"""
+        raise NotImplementedError
+
+    def list_page(self, after_id=None, limit=None):
+        """Users with id > after_id as (id, name) tuples, at most limit"""
+        raise NotImplementedError
+
+    def bulk_load(self, rows):
+        """Insert many (id, name) rows, skipping taken ids; returns count inserted"""
+        raise NotImplementedError
+
+    def export(self):
+        """Iterate over every (id, name) in id order"""
+        raise NotImplementedError
+
+    def lease_id_block(self, size):
+        """Reserve size consecutive fresh ids and return the first
+
+        Blocks never overlap across workers or nodes. They start above the
+        highest id present when the allocator was created, but client-chosen
+        ids may still land inside a leased block later, so callers must
+        handle the occasional conflict.
+        """
+        raise NotImplementedError
+
+    def reserve_ids(self, user_ids, ttl):
+        """Hold ids for ttl seconds as suggestions; returns those held for us
+
+        Ids another caller holds are left out. This default only guards
+        against other threads in the process, which is enough for backends
+        whose table is per process; shared backends hold them in the database.
+        """
+        return list(user_ids)
+
+    def ping(self):
+        """True if the backend is reachable"""
+        raise NotImplementedError
+
+    def stats(self):
+        """Connection pool and breaker state for readiness reporting"""
+        return {}
+
+    def version(self):
+        """Marker that changes whenever the users table may have changed
+
+        Comparable only with markers from the same backend; None when the
+        backend cannot provide one, which callers treat as "unknown".
+        """
+        return None
+
+    def close(self):
+        """Release connections held by the backend"""
+
+    def after_fork(self):
+        """Drop connections and restart threads inherited from a pre-fork parent"""
+
+    def warm(self):
+        """Open connections ahead of traffic"""
+
+    def subscribe(self, callback):
+        """Call callback(op, user_id, name) after each change
+
+        op is 'add', 'delete', or 'reload' (user_id None) when changes may
+        have been missed and subscribers should rebuild. Backends that can
+        see other workers' writes report those as well.
+        """
+        self.__dict__.setdefault('_subscribers', []).append(callback)
+
+    def publish(self, op, user_id=None, name=None):
+        """Tell subscribers about a change"""
+        for callback in self.__dict__.get('_subscribers', ()):
+            try:
+                callback(op, user_id, name)
+            except Exception as e:
+                print(f"Change subscriber failed: {e}")
+
+
+def get_database_url():
+    """Postgres URL from DATABASE_URL or the PG* variables"""
+    # Try DATABASE_URL first (easiest for Render)
+    database_url = os.environ.get('DATABASE_URL')
+    if database_url:
+        return database_url
+
+    # If not set, try individual variables
+    db_host = os.environ.get('PGHOST')
+    db_port = os.environ.get('PGPORT', '5432')
+    db_name = os.environ.get('PGDATABASE')
+    db_user = os.environ.get('PGUSER')
+    db_password = os.environ.get('PGPASSWORD')
+
+    if all([db_host, db_name, db_user, db_password]):
+        return f"postgresql://{db_user}:{db_password}@{db_host}:{db_port}/{db_name}"
+    return None
+
+
+def get_db_connection():
+    """Get database connection"""
+    try:
+        database_url = get_database_url()
+        if not database_url:
+            print("ERROR: No database connection configured!")
+            print("Set either DATABASE_URL or PGHOST/PGDATABASE/PGUSER/PGPASSWORD")
+            return None
+
+        print(f"Connecting to database...")
+        conn = psycopg.connect(database_url, connect_timeout=connect_timeout())
+        print("Database connection successful!")
+        return conn
+
+    except Exception as e:
+        print(f"Database connection failed: {e}")
+        return None
+
+
+class PostgresStorage(Storage):
+    """Postgres backend, pooled when psycopg_pool is installed"""
+
+    name = 'postgres'
+
+    # Through LISTEN/NOTIFY
+    shares_changes = True
+
+    CREATE_TABLE = """
+        CREATE TABLE IF NOT EXISTS users(
+            id INTEGER PRIMARY KEY,
+            name VARCHAR(100) NOT NULL
+        )
+    """
+
+    # Insert, or report the existing name, in one statement. The SELECT runs
+    # against the statement snapshot, so it sees the conflicting row.
+    ADD_IF_ABSENT = """
+        WITH ins AS (
+            INSERT INTO users (id, name) VALUES (%(id)s, %(name)s)
+            ON CONFLICT (id) DO NOTHING
+            RETURNING id
+        )
+        SELECT EXISTS (SELECT 1 FROM ins),
+               (SELECT name FROM users WHERE id = %(id)s)
+    """
+
+    CREATE_ALLOCATOR = """
+        CREATE TABLE IF NOT EXISTS id_allocator(
+            name VARCHAR(50) PRIMARY KEY,
+            next_id BIGINT NOT NULL
+        )
+    """
+
+    # Multi-row ADD_IF_ABSENT: one outcome row per input row
+    ADD_MANY_IF_ABSENT = """
+        WITH input AS (
+            SELECT * FROM unnest(%(ids)s::integer[], %(names)s::varchar[]) AS t(id, name)
+        ), ins AS (
+            INSERT INTO users (id, name) SELECT id, name FROM input
+            ON CONFLICT (id) DO NOTHING
+            RETURNING id
+        )
+        SELECT input.id, ins.id IS NOT NULL, users.name
+        FROM input
+        LEFT JOIN ins ON ins.id = input.id
+        LEFT JOIN users ON users.id = input.id
+    """
+
+    CREATE_RESERVATIONS = """
+        CREATE TABLE IF NOT EXISTS id_reservations(
+            id INTEGER PRIMARY KEY,
+            expires_at TIMESTAMPTZ NOT NULL
+        )
+    """
+
+    # Takes the requested ids that are free or whose hold has lapsed, and
+    # clears a few other lapsed holds so the table stays small
+    RESERVE = """
+        WITH lapsed AS (
+            DELETE FROM id_reservations WHERE id IN (
+                SELECT id FROM id_reservations
+                WHERE expires_at <= now() AND id <> ALL(%(ids)s::integer[])
+                LIMIT 100)
+        )
+        INSERT INTO id_reservations (id, expires_at)
+        SELECT id, now() + make_interval(secs => %(ttl)s) FROM unnest(%(ids)s::integer[]) AS t(id)
+        ON CONFLICT (id) DO UPDATE SET expires_at = EXCLUDED.expires_at
+            WHERE id_reservations.expires_at <= now()
+        RETURNING id
+    """
+
+    GET_USER = "SELECT id, name FROM users WHERE id = %s"
+    GET_MANY = "SELECT id, name FROM users WHERE id = ANY(%s)"
+    LIST_FIRST = "SELECT id, name FROM users ORDER BY id LIMIT %s"
+    LIST_AFTER = "SELECT id, name FROM users WHERE id > %s ORDER BY id LIMIT %s"
+    DELETE = "DELETE FROM users WHERE id = %s"
+    LEASE = ("UPDATE id_allocator SET next_id = next_id + %s "
+             "WHERE name = 'users' RETURNING next_id - %s")
+
+    # Transaction-local, so they lapse with the statements they guard
+    SET_TIMEOUTS = ("SELECT set_config('statement_timeout', %s, true), "
+                    "set_config('lock_timeout', %s, true)")
+
+    # The fixed query set, prepared once per connection when prepare is on
+    PREPARED = (GET_USER, GET_MANY, LIST_FIRST, LIST_AFTER, DELETE, LEASE,
+                ADD_IF_ABSENT, ADD_MANY_IF_ABSENT, SET_TIMEOUTS)
+
+    # Bumped by every statement that writes to users. Sequences are not
+    # transactional and take no row locks, so writers never queue on it;
+    # rolled-back writes bump it too, which only costs a false "changed".
+    CREATE_VERSION = (
+        "CREATE SEQUENCE IF NOT EXISTS users_version",
+        """
+        CREATE OR REPLACE FUNCTION users_version_bump() RETURNS trigger AS $$
+        BEGIN
+            PERFORM nextval('users_version');
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+        """,
+        """
+        CREATE OR REPLACE TRIGGER users_version_bump
+        AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON users
+        FOR EACH STATEMENT EXECUTE FUNCTION users_version_bump()
+        """,
+    )
+
+    # LISTEN/NOTIFY channel carrying changes between workers and nodes
+    CHANNEL = 'users_changed'
+
+    # Statements changing more rows than this notify a single 'reload'
+    NOTIFY_MAX_ROWS = 1000
+
+    # Every write to users notifies CHANNEL from a trigger, so changes made
+    # by any client (CLI bulk loads, scripts, psql) reach the listeners.
+    # The payload's origin is the writer's application_name, which lets a
+    # worker skip its own changes; it has already published them locally.
+    CREATE_NOTIFY = (
+        f"""
+        CREATE OR REPLACE FUNCTION users_notify() RETURNS trigger AS $$
+        DECLARE
+            origin text := current_setting('application_name');
+            changed bigint := 0;
+        BEGIN
+            IF TG_OP = 'TRUNCATE' THEN
+                changed := NULL;
+            ELSE
+                IF TG_OP IN ('DELETE', 'UPDATE') THEN
+                    SELECT changed + count(*) INTO changed FROM old_rows;
+                END IF;
+                IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                    SELECT changed + count(*) INTO changed FROM new_rows;
+                END IF;
+            END IF;
+            IF changed IS NULL OR changed > {NOTIFY_MAX_ROWS} THEN
+                PERFORM pg_notify('{CHANNEL}',
+                                  json_build_object('op', 'reload', 'origin', origin)::text);
+                RETURN NULL;
+            END IF;
+            IF TG_OP IN ('DELETE', 'UPDATE') THEN
+                PERFORM pg_notify('{CHANNEL}', json_build_object(
+                    'op', 'delete', 'id', id, 'origin', origin)::text) FROM old_rows;
+            END IF;
+            IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                PERFORM pg_notify('{CHANNEL}', json_build_object(
+                    'op', 'add', 'id', id, 'name', name, 'origin', origin)::text) FROM new_rows;
+            END IF;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+        """,
+        # Transition tables allow one event per trigger
+        """
+        CREATE OR REPLACE TRIGGER users_notify_insert AFTER INSERT ON users
+        REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION users_notify()
+        """,
+        """
+        CREATE OR REPLACE TRIGGER users_notify_update AFTER UPDATE ON users
+        REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION users_notify()
+        """,
+        """
+        CREATE OR REPLACE TRIGGER users_notify_delete AFTER DELETE ON users
+        REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE FUNCTION users_notify()
+        """,
+        """
+        CREATE OR REPLACE TRIGGER users_notify_truncate AFTER TRUNCATE ON users
+        FOR EACH STATEMENT EXECUTE FUNCTION users_notify()
+        """,
+    )
+
+    def __init__(self, conninfo=None, connect=None, pool_min=1, pool_max=10, pipeline=True,
+                 prepare=True, autocommit_reads=True, pool_timeout=5.0, breaker=None,
+                 listen=True):
+        self.conninfo = conninfo
+        self.connect = connect or get_db_connection
+        self.pool_min = pool_min
+        self.pool_max = pool_max
+        # Pipeline mode needs libpq 14+
+        self.pipeline = pipeline and psycopg.Pipeline.is_supported()
+        # Off behind pgbouncer in transaction mode, where a statement
+        # prepared on one server connection is unknown on the next
+        self.prepare = prepare
+        self.autocommit_reads = autocommit_reads
+        # Longest a request waits for a pooled connection
+        self.pool_timeout = pool_timeout
+        # Optional CircuitBreaker failing calls fast while the database is down
+        self.breaker = breaker
+        # False in a preloading master: subscribe() then leaves the LISTEN
+        # connection to the workers, started by after_fork()
+        self.listen = listen
+        self.pool = None
+        self._pool_lock = threading.Lock()
+        self._schema_ready = False
+        self._allocator_ready = False
+        self._reservations_ready = False
+        self._listener = None
+
+    def get_pool(self):
+        """Create the pool on first use, so it is never shared across a fork"""
+        if self.pool is None and ConnectionPool is not None and self.pool_max > 0:
+            with self._pool_lock:
+                if self.pool is None:
+                    conninfo = self.conninfo or get_database_url()
+                    if not conninfo:
+                        return None
+                    self.pool = ConnectionPool(conninfo, min_size=self.pool_min,
+                                               max_size=self.pool_max, open=True,
+                                               timeout=self.pool_timeout,
+                                               kwargs={'connect_timeout': connect_timeout(),
+                                                       'application_name': self.origin()},
+                                               configure=self.configure, name='users')
+        return self.pool
+
+    @staticmethod
+    def origin():
+        """application_name tagging this process's changes (63 bytes at most)"""
+        return f"users:{os.getpid()}:{socket.gethostname()}"[:63]
+
+    def configure(self, conn):
+        """Set up a new connection's prepared statement cache
+
+        With prepare on, queries in PREPARED are prepared on their first
+        execution on each connection (psycopg keeps the per-connection
+        registry) and the cache is sized to hold all of them. With it off,
+        psycopg's own automatic preparing is disabled too.
+        """
+        if self.prepare:
+            if conn.prepared_max is not None and conn.prepared_max < len(self.PREPARED):
+                conn.prepared_max = len(self.PREPARED)
+        else:
+            conn.prepare_threshold = None
+
+    def _run(self, conn, sql, params=None):
+        """conn.execute, preparing the statement if it is in the fixed set"""
+        return conn.execute(sql, params, prepare=self.prepare and sql in self.PREPARED)
+
+    def timeout_statements(self):
+        """SET_TIMEOUTS for what is left of the request's deadline, if it has one"""
+        timeout = deadlines.timeout_ms()
+        if timeout is None:
+            return []
+        return [(self.SET_TIMEOUTS, (str(timeout), str(timeout)))]
+
+    def execute(self, conn, sql, params=None):
+        """Run one statement, bounded by the request's remaining deadline
+
+        The timeouts are transaction-local, so outside a transaction they
+        share an implicit one with the statement: pipelined (no extra
+        round trip) when possible, else an explicit transaction.
+        """
+        timeouts = self.timeout_statements()
+        if not timeouts:
+            return self._run(conn, sql, params)
+        if not conn.autocommit:
+            self._run(conn, *timeouts[0])
+            return self._run(conn, sql, params)
+        if self.pipeline:
+            with conn.pipeline():
+                self._run(conn, *timeouts[0])
+                return self._run(conn, sql, params)
+        with conn.transaction():
+            self._run(conn, *timeouts[0])
+            return self._run(conn, sql, params)
+
+    @contextmanager
+    def connection(self):
+        """A connection inside a transaction that commits on success
+
+        Connection failures (including timeouts waiting on the pool) are
+        raised as StorageUnavailable, or ConnectDeadlineExceeded when the
+        request's deadline cut the wait short, and count against the
+        breaker; other deadline errors count neither way. While
+        it is open this raises StorageUnavailable without touching the
+        network.
+        """
+        if self.breaker is None:
+            with self._connection() as conn:
+                yield conn
+            return
+
+        try:
+            self.breaker.before_call()
+        except CircuitOpen as e:
+            raise StorageUnavailable(str(e), retry_after=e.retry_after) from e
+        try:
+            with self._connection() as conn:
+                yield conn
+        except (StorageUnavailable, ConnectDeadlineExceeded):
+            self.breaker.record_failure()
+            raise
+        except deadlines.DeadlineExceeded:
+            # The request ran out of time; that says nothing either way
+            self.breaker.record_inconclusive()
+            raise
+        except BaseException:
+            # Any other error came back from a reachable database
+            self.breaker.record_success()
+            raise
+        else:
+            self.breaker.record_success()
+
+    def unavailable(self, error, connecting=False):
+        """The StorageError to raise for a psycopg OperationalError
+
+        Cancellations and lock timeouts under a deadline, and pool waits
+        cut short by one, are the request running out of time rather than
+        the database being down.
+        """
+        left = deadlines.remaining()
+        if left is not None and (left <= 0 or isinstance(
+                error, (psycopg.errors.QueryCanceled, psycopg.errors.LockNotAvailable))):
+            exceeded = deadlines.exceeded(str(error))
+            return ConnectDeadlineExceeded(str(exceeded)) if connecting else exceeded
+        return StorageUnavailable(str(error))
+
+    @contextmanager
+    def _connection(self):
+        pool = self.get_pool()
+        if pool is not None:
+            timeout = self.pool_timeout
+            left = deadlines.remaining()
+            if left is not None:
+                if left <= 0:
+                    raise deadlines.exceeded()
+                timeout = min(timeout, left)
+            acquired = False
+            try:
+                with pool.connection(timeout=timeout) as conn:
+                    acquired = True
+                    yield conn
+            except psycopg.OperationalError as e:
+                raise self.unavailable(e, connecting=not acquired) from e
+            return
+
+        conn = self.connect()
+        if conn is None:
+            raise StorageUnavailable('Database connection failed')
+        self.configure(conn)
+        try:
+            with conn:
+                yield conn
+        except psycopg.OperationalError as e:
+            raise self.unavailable(e) from e
+        finally:
+            conn.close()
+
+    @contextmanager
+    def read_connection(self, consistent=False):
+        """A connection for reads that never write
+
+        A single SELECT runs in autocommit, saving the BEGIN and COMMIT
+        round trips. Reads spanning several statements (consistent=True)
+        get a READ ONLY transaction instead, so they share one snapshot.
+        """
+        with self.connection() as conn:
+            if consistent:
+                conn.read_only = True
+            elif self.autocommit_reads:
+                conn.autocommit = True
+            try:
+                yield conn
+            finally:
+                # Back to the defaults before the pool hands it out again
+                if consistent:
+                    if not conn.closed:
+                        conn.rollback()  # nothing to keep from a read-only transaction
+                    conn.read_only = None
+                elif self.autocommit_reads:
+                    conn.autocommit = False
+
+    def execute_all(self, conn, statements, commit=False):
+        """Run (sql, params) statements back to back, returning their cursors
+
+        In pipeline mode they are sent with a single Sync on an autocommit
+        connection, which Postgres runs as one implicit transaction: one
+        network round trip for the lot, instead of one each plus BEGIN and
+        COMMIT. Pass commit=True only for statements that may commit
+        together, since this ends any transaction the caller had open.
+        """
+        timeouts = self.timeout_statements()
+        statements = timeouts + list(statements)
+        if self.pipeline and commit:
+            conn.autocommit = True
+            try:
+                with conn.pipeline():
+                    cursors = [self._run(conn, sql, params) for sql, params in statements]
+            finally:
+                conn.autocommit = False
+        else:
+            cursors = [self._run(conn, sql, params) for sql, params in statements]
+            if commit:
+                conn.commit()
+        return cursors[len(timeouts):]
+
+    def schema_statements(self):
+        """CREATE TABLE, until it has run once in this process"""
+        return [] if self._schema_ready else [(self.CREATE_TABLE, None)]
+
+    def ensure_schema(self, conn):
+        if not self._schema_ready:
+            conn.execute(self.CREATE_TABLE)
+            self._schema_ready = True
+
+    def initialize(self):
+        with self.connection() as conn:
+            self.ensure_schema(conn)
+            for statement in self.CREATE_VERSION + self.CREATE_NOTIFY:
+                conn.execute(statement)
+        print("Users table ready!")
+
+    def version(self):
+        try:
+            with self.read_connection() as conn:
+                last_value, is_called = conn.execute(
+                    "SELECT last_value, is_called FROM users_version").fetchone()
+        except psycopg.errors.UndefinedTable:
+            return None  # initialize() has not run since the marker was added
+        return last_value if is_called else 0
+
+    def get(self, user_id):
+        with self.read_connection() as conn:
+            row = self.execute(conn, self.GET_USER, (user_id,)).fetchone()
+        return row[1] if row else None
+
+    def get_many(self, user_ids):
+        with self.read_connection() as conn:
+            rows = self.execute(conn, self.GET_MANY, (list(user_ids),)).fetchall()
+        return dict(rows)
+
+    def add_if_absent(self, user_id, name):
+        statements = self.schema_statements()
+        statements.append((self.ADD_IF_ABSENT, {'id': user_id, 'name': name}))
+        position = len(statements) - 1
+        with self.connection() as conn:
+            cursors = self.execute_all(conn, statements, commit=True)
+            inserted, existing = cursors[position].fetchone()
+        self._schema_ready = True
+        if inserted:
+            self.publish('add', user_id, name)
+            return True, None
+        return False, existing
+
+    def add_many_if_absent(self, rows):
+        rows = list(rows)
+        if not rows:
+            return []
+        ids = [user_id for user_id, _ in rows]
+        names = [name for _, name in rows]
+        statements = self.schema_statements()
+        statements.append((self.ADD_MANY_IF_ABSENT, {'ids': ids, 'names': names}))
+        position = len(statements) - 1
+        with self.connection() as conn:
+            results = self.execute_all(conn, statements, commit=True)[position].fetchall()
+        self._schema_ready = True
+        outcomes = {user_id: (inserted, existing) for user_id, inserted, existing in results}
+        for user_id, name in rows:
+            if outcomes[user_id][0]:
+                self.publish('add', user_id, name)
+        return [(True, None) if outcomes[user_id][0] else (False, outcomes[user_id][1])
+                for user_id, _ in rows]
+
+    def delete(self, user_id):
+        with self.connection() as conn:
+            cursor = self.execute_all(conn, [(self.DELETE, (user_id,))], commit=True)[0]
+        if cursor.rowcount:
+            self.publish('delete', user_id)
+        return cursor.rowcount > 0
+
+    def list_page(self, after_id=None, limit=None):
+        with self.read_connection() as conn:
+            if after_id is None:
+                cursor = self.execute(conn, self.LIST_FIRST, (limit,))
+            else:
+                cursor = self.execute(conn, self.LIST_AFTER, (after_id, limit))
+            return cursor.fetchall()
+
+    def bulk_load(self, rows):
+        with self.connection() as conn:
+            self.ensure_schema(conn)
+            conn.execute("CREATE TEMP TABLE users_load (LIKE users) ON COMMIT DROP")
+            with conn.cursor() as cursor:
+                with cursor.copy("COPY users_load (id, name) FROM STDIN") as copy:
+                    for row in rows:
+                        copy.write_row(row)
+                cursor.execute("INSERT INTO users (id, name) SELECT id, name FROM users_load "
+                               "ON CONFLICT (id) DO NOTHING")
+                inserted = cursor.rowcount
+        self.publish('reload')
+        return inserted
+
+    def export(self):
+        with self.read_connection(consistent=True) as conn:
+            with conn.cursor(name='users_export') as cursor:
+                cursor.itersize = 10_000
+                cursor.execute("SELECT id, name FROM users ORDER BY id")
+                yield from cursor
+
+    def ping(self):
+        try:
+            with self.read_connection() as conn:
+                conn.execute("SELECT 1")
+            return True
+        except Exception as e:
+            print(f"Database ping failed: {e}")
+            return False
+
+    def lease_id_block(self, size):
+        statements = []
+        if not self._allocator_ready:
+            statements = self.schema_statements() + [
+                (self.CREATE_ALLOCATOR, None),
+                ("INSERT INTO id_allocator (name, next_id) "
+                 "SELECT 'users', COALESCE(MAX(id), 0) + 1 FROM users "
+                 "ON CONFLICT (name) DO NOTHING", None),
+            ]
+        # The row lock serializes concurrent leases
+        statements.append((self.LEASE, (size, size)))
+        with self.connection() as conn:
+            row = self.execute_all(conn, statements, commit=True)[-1].fetchone()
+        self._schema_ready = self._allocator_ready = True
+        return row[0]
+
+    def reserve_ids(self, user_ids, ttl):
+        user_ids = list(user_ids)
+        if not user_ids:
+            return []
+        statements = [] if self._reservations_ready else [(self.CREATE_RESERVATIONS, None)]
+        statements.append((self.RESERVE, {'ids': user_ids, 'ttl': ttl}))
+        with self.connection() as conn:
+            held = {row[0] for row in self.execute_all(conn, statements, commit=True)[-1]}
+        self._reservations_ready = True
+        return [user_id for user_id in user_ids if user_id in held]
+
+    def subscribe(self, callback):
+        """Also start listening for changes made by other workers"""
+        super().subscribe(callback)
+        if self.listen:
+            self.start_listener()
+
+    def start_listener(self):
+        if self._listener is None and (self.conninfo or get_database_url()):
+            self._listener = threading.Thread(target=self._listen, name='users-listener', daemon=True)
+            self._listener.start()
+
+    def _listen(self):
+        backoff = 1.0
+        while True:
+            try:
+                # Keepalives, so a silently dropped connection errors out
+                # instead of leaving notifies() waiting forever
+                with psycopg.connect(self.conninfo or get_database_url(), autocommit=True,
+                                     connect_timeout=connect_timeout(), keepalives=1,
+                                     keepalives_idle=30, keepalives_interval=10,
+                                     keepalives_count=3) as conn:
+                    conn.execute(f"LISTEN {self.CHANNEL}")
+                    # Anything sent before this LISTEN (while disconnected, or
+                    # between a subscriber's initial load and now) is lost
+                    self.publish('reload')
+                    backoff = 1.0
+                    origin = self.origin()
+                    for notify in conn.notifies():
+                        change = json.loads(notify.payload)
+                        if change.get('origin') == origin:
+                            continue  # already published locally
+                        self.publish(change['op'], change.get('id'), change.get('name'))
+            except Exception as e:
+                print(f"Change listener disconnected: {e}")
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 30.0)
+
+    def stats(self):
+        stats = {}
+        pool = self.pool
+        if pool is not None:
+            pool_stats = pool.get_stats()
+            size = pool_stats.get('pool_size', 0)
+            available = pool_stats.get('pool_available', 0)
+            stats['pool'] = {
+                'size': size,
+                'available': available,
+                'max': self.pool_max,
+                'waiting': pool_stats.get('requests_waiting', 0),
+                'saturation': round((size - available) / self.pool_max, 3),
+            }
+        if self.breaker is not None:
+            stats['breaker'] = self.breaker.stats()
+        return stats
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool = None
+
+    def warm(self, timeout=10.0):
+        """Wait until the pool holds its minimum number of connections"""
+        pool = self.get_pool()
+        if pool is not None:
+            try:
+                pool.wait(timeout)
+            except psycopg.OperationalError as e:
+                raise StorageUnavailable(str(e)) from e
+
+    def after_fork(self):
+        # The parent's pool sockets are shared with it; forget them unclosed
+        # rather than terminating the parent's sessions
+        self.pool = None
+        self._pool_lock = threading.Lock()
+        self.listen = True
+        self._listener = None
+        if self.__dict__.get('_subscribers'):
+            self.start_listener()
+
+
+class SQLiteStorage(Storage):
+    """SQLite backend in WAL mode with memory-mapped reads
+
+    Shares users.db with database.js, whose table stores ids as TEXT, so ids
+    are cast to integers for ordering and cast back to int on the way out.
+    """
+
+    name = 'sqlite'
+
+    def __init__(self, path='users.db', mmap_size=256 * 1024 * 1024):
+        self.path = path
+        self.mmap_size = mmap_size
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+
+    def connection(self):
+        """One connection per thread"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(f"PRAGMA mmap_size={int(self.mmap_size)}")
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def initialize(self):
+        with self.connection() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS users (id INTEGER PRIMARY KEY, name TEXT NOT NULL)")
+        print("Users table ready!")
+
+    def get(self, user_id):
+        row = self.connection().execute("SELECT name FROM users WHERE id = ?", (user_id,)).fetchone()
+        return row[0] if row else None
+
+    def get_many(self, user_ids):
+        user_ids = list(user_ids)
+        found = {}
+        conn = self.connection()
+        # Stay well under SQLITE_MAX_VARIABLE_NUMBER
+        for start in range(0, len(user_ids), 500):
+            chunk = user_ids[start:start + 500]
+            placeholders = ','.join('?' * len(chunk))
+            for user_id, name in conn.execute(
+                    f"SELECT id, name FROM users WHERE id IN ({placeholders})", chunk):
+                found[int(user_id)] = name
+        return found
+
+    def add_if_absent(self, user_id, name):
+        with self.connection() as conn:
+            cursor = conn.execute("INSERT INTO users (id, name) VALUES (?, ?) "
+                                  "ON CONFLICT (id) DO NOTHING", (user_id, name))
+            if not cursor.rowcount:
+                row = conn.execute("SELECT name FROM users WHERE id = ?", (user_id,)).fetchone()
+                return False, row[0] if row else None
+        self.publish('add', user_id, name)
+        return True, None
+
+    def add_many_if_absent(self, rows):
+        outcomes = []
+        with self.connection() as conn:
+            for user_id, name in rows:
+                cursor = conn.execute("INSERT INTO users (id, name) VALUES (?, ?) "
+                                      "ON CONFLICT (id) DO NOTHING", (user_id, name))
+                if cursor.rowcount:
+                    outcomes.append((True, None))
+                else:
+                    row = conn.execute("SELECT name FROM users WHERE id = ?", (user_id,)).fetchone()
+                    outcomes.append((False, row[0] if row else None))
+        for (user_id, name), (inserted, _) in zip(rows, outcomes):
+            if inserted:
+                self.publish('add', user_id, name)
+        return outcomes
+
+    def delete(self, user_id):
+        with self.connection() as conn:
+            cursor = conn.execute("DELETE FROM users WHERE id = ?", (user_id,))
+        if cursor.rowcount:
+            self.publish('delete', user_id)
+        return cursor.rowcount > 0
+
+    def list_page(self, after_id=None, limit=None):
+        rows = self.connection().execute(
+            "SELECT id, name FROM users WHERE CAST(id AS INTEGER) > ? "
+            "ORDER BY CAST(id AS INTEGER) LIMIT ?",
+            (after_id if after_id is not None else -2**63, limit if limit is not None else -1))
+        return [(int(user_id), name) for user_id, name in rows]
+
+    def bulk_load(self, rows):
+        with self.connection() as conn:
+            before = conn.total_changes
+            conn.executemany("INSERT INTO users (id, name) VALUES (?, ?) "
+                             "ON CONFLICT (id) DO NOTHING", rows)
+            inserted = conn.total_changes - before
+        self.publish('reload')
+        return inserted
+
+    def lease_id_block(self, size):
+        with self.connection() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS id_allocator (name TEXT PRIMARY KEY, next_id INTEGER NOT NULL)")
+            # The INSERT takes the write lock, serializing concurrent leases
+            conn.execute("INSERT INTO id_allocator (name, next_id) "
+                         "SELECT 'users', COALESCE(MAX(CAST(id AS INTEGER)), 0) + 1 FROM users WHERE true "
+                         "ON CONFLICT (name) DO NOTHING")
+            row = conn.execute("UPDATE id_allocator SET next_id = next_id + ? "
+                               "WHERE name = 'users' RETURNING next_id - ?", (size, size)).fetchone()
+        return row[0]
+
+    def export(self):
+        cursor = self.connection().execute("SELECT id, name FROM users ORDER BY CAST(id AS INTEGER)")
+        for user_id, name in cursor:
+            yield int(user_id), name
+
+    def ping(self):
+        try:
+            self.connection().execute("SELECT 1")
+            return True
+        except sqlite3.Error as e:
+            print(f"Database ping failed: {e}")
+            return False
+
+    def close(self):
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+        self._local = threading.local()
+
+
+class MySQLStorage(Storage):
+    """MySQL backend on a mysql.connector connection pool"""
+
+    name = 'mysql'
+
+    def __init__(self, host='localhost', port=3306, user='root', password='',
+                 database='userdb', pool_size=10, pool_timeout=5.0):
+        if mysql is None:
+            raise StorageError('mysql-connector-python is not installed')
+        self.config = {
+            'host': host,
+            'port': port,
+            'user': user,
+            'password': password,
+            'database': database,
+        }
+        self.pool_size = pool_size
+        self.pool_timeout = pool_timeout
+        self.pool = None
+        self._pool_lock = threading.Lock()
+
+    def get_pool(self):
+        if self.pool is None:
+            with self._pool_lock:
+                if self.pool is None:
+                    self.pool = mysql.connector.pooling.MySQLConnectionPool(
+                        pool_name='users', pool_size=self.pool_size,
+                        pool_reset_session=True, **self.config)
+        return self.pool
+
+    def get_connection(self):
+        """Borrow a pooled connection, waiting up to pool_timeout if all are busy
+
+        mysql.connector fails at once on an exhausted pool, so retry until
+        the wait (or the request's deadline) runs out. A busy pool is load,
+        not a database failure: it gets a Retry-After, not a breaker strike.
+        """
+        wait = self.pool_timeout
+        left = deadlines.remaining()
+        if left is not None:
+            wait = min(wait, left)
+        give_up = time.monotonic() + wait
+        while True:
+            try:
+                return self.get_pool().get_connection()
+            except mysql.connector.errors.PoolError as e:
+                if time.monotonic() < give_up:
+                    time.sleep(0.005)
+                    continue
+                if left is not None and left <= self.pool_timeout:
+                    raise deadlines.exceeded(str(e)) from e
+                raise StorageUnavailable(f"Connection pool exhausted: {e}", retry_after=1.0) from e
+            except mysql.connector.Error as e:
+                raise StorageUnavailable(str(e)) from e
+
+    @contextmanager
+    def connection(self):
+        """A pooled connection, committed on success and returned to the pool"""
+        conn = self.get_connection()
+        try:
+            # Pooled connections can sit idle past wait_timeout
+            conn.ping(reconnect=True, attempts=3, delay=0.5)
+            yield conn
+            conn.commit()
+        except Exception:
+            try:
+                conn.rollback()
+            except mysql.connector.Error as e:
+                # A dead connection must not hide the original error
+                print(f"Rollback failed: {e}")
+            raise
+        finally:
+            conn.close()
+
+    def initialize(self):
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("CREATE TABLE IF NOT EXISTS users ("
+                           "id INT PRIMARY KEY, name VARCHAR(100) NOT NULL)")
+            cursor.close()
+        print("Users table ready!")
+
+    def get(self, user_id):
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT name FROM users WHERE id = %s", (user_id,))
+            row = cursor.fetchone()
+            cursor.close()
+        return row[0] if row else None
+
+    def get_many(self, user_ids):
+        user_ids = list(user_ids)
+        if not user_ids:
+            return {}
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            placeholders = ','.join(['%s'] * len(user_ids))
+            cursor.execute(f"SELECT id, name FROM users WHERE id IN ({placeholders})", user_ids)
+            rows = cursor.fetchall()
+            cursor.close()
+        return dict(rows)
+
+    def add_if_absent(self, user_id, name):
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            # rowcount is 1 for an insert and 0 when the id was already taken
+            cursor.execute("INSERT INTO users (id, name) VALUES (%s, %s) "
+                           "ON DUPLICATE KEY UPDATE id = id", (user_id, name))
+            inserted = cursor.rowcount == 1
+            if not inserted:
+                cursor.execute("SELECT name FROM users WHERE id = %s", (user_id,))
+                row = cursor.fetchone()
+            cursor.close()
+        if not inserted:
+            return False, row[0] if row else None
+        self.publish('add', user_id, name)
+        return True, None
+
+    def add_many_if_absent(self, rows):
+        outcomes = []
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            for user_id, name in rows:
+                cursor.execute("INSERT INTO users (id, name) VALUES (%s, %s) "
+                               "ON DUPLICATE KEY UPDATE id = id", (user_id, name))
+                if cursor.rowcount == 1:
+                    outcomes.append((True, None))
+                else:
+                    cursor.execute("SELECT name FROM users WHERE id = %s", (user_id,))
+                    row = cursor.fetchone()
+                    outcomes.append((False, row[0] if row else None))
+            cursor.close()
+        for (user_id, name), (inserted, _) in zip(rows, outcomes):
+            if inserted:
+                self.publish('add', user_id, name)
+        return outcomes
+
+    def delete(self, user_id):
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("DELETE FROM users WHERE id = %s", (user_id,))
+            deleted = cursor.rowcount > 0
+            cursor.close()
+        if deleted:
+            self.publish('delete', user_id)
+        return deleted
+
+    def list_page(self, after_id=None, limit=None):
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT id, name FROM users WHERE id > %s ORDER BY id LIMIT %s",
+                           (after_id if after_id is not None else -2**31,
+                            limit if limit is not None else 2**63 - 1))
+            rows = cursor.fetchall()
+            cursor.close()
+        return rows
+
+    def bulk_load(self, rows):
+        rows = list(rows)
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.executemany("INSERT IGNORE INTO users (id, name) VALUES (%s, %s)", rows)
+            inserted = cursor.rowcount
+            cursor.close()
+        self.publish('reload')
+        return inserted
+
+    def lease_id_block(self, size):
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("CREATE TABLE IF NOT EXISTS id_allocator ("
+                           "name VARCHAR(50) PRIMARY KEY, next_id BIGINT NOT NULL)")
+            cursor.execute("INSERT IGNORE INTO id_allocator (name, next_id) "
+                           "SELECT 'users', COALESCE(MAX(id), 0) + 1 FROM users")
+            # LAST_INSERT_ID(expr) hands the new value back on this connection
+            cursor.execute("UPDATE id_allocator SET next_id = LAST_INSERT_ID(next_id + %s) "
+                           "WHERE name = 'users'", (size,))
+            cursor.execute("SELECT LAST_INSERT_ID()")
+            next_id = cursor.fetchone()[0]
+            cursor.close()
+        return next_id - size
+
+    def export(self):
+        with self.connection() as conn:
+            cursor = conn.cursor(buffered=False)
+            cursor.execute("SELECT id, name FROM users ORDER BY id")
+            yield from cursor
+            cursor.close()
+
+    def ping(self):
+        try:
+            with self.connection() as conn:
+                conn.ping(reconnect=True)
+            return True
+        except Exception as e:
+            print(f"Database ping failed: {e}")
+            return False
+
+
+class InMemoryStorage(Storage):
+    """Process-local dict backend for development and benchmarks"""
+
+    name = 'memory'
+
+    # Each process has its own table, so there is nothing to miss
+    shares_changes = True
+
+    def __init__(self):
+        self.users = {}
+        self._sorted_ids = None
+        self._next_lease = None
+        self._lock = threading.Lock()
+
+    def _ids(self):
+        if self._sorted_ids is None:
+            self._sorted_ids = sorted(self.users)
+        return self._sorted_ids
+
+    def initialize(self):
+        print("Users table ready!")
+
+    def get(self, user_id):
+        return self.users.get(user_id)
+
+    def get_many(self, user_ids):
+        users = self.users
+        return {user_id: users[user_id] for user_id in user_ids if user_id in users}
+
+    def add_if_absent(self, user_id, name):
+        with self._lock:
+            existing = self.users.get(user_id)
+            if existing is not None:
+                return False, existing
+            self.users[user_id] = name
+            self._sorted_ids = None
+        self.publish('add', user_id, name)
+        return True, None
+
+    def delete(self, user_id):
+        with self._lock:
+            if self.users.pop(user_id, None) is None:
+                return False
+            self._sorted_ids = None
+        self.publish('delete', user_id)
+        return True
+
+    def list_page(self, after_id=None, limit=None):
+        with self._lock:
+            ids = self._ids()
+            start = 0 if after_id is None else bisect.bisect_right(ids, after_id)
+            stop = len(ids) if limit is None else start + limit
+            return [(user_id, self.users[user_id]) for user_id in ids[start:stop]]
+
+    def bulk_load(self, rows):
+        inserted = 0
+        with self._lock:
+            for user_id, name in rows:
+                if user_id not in self.users:
+                    self.users[user_id] = name
+                    inserted += 1
+            self._sorted_ids = None
+        self.publish('reload')
+        return inserted
+
+    def lease_id_block(self, size):
+        with self._lock:
+            if self._next_lease is None:
+                self._next_lease = max(self.users, default=0) + 1
+            start = self._next_lease
+            self._next_lease += size
+        return start
+
+    def export(self):
+        return iter(self.list_page())
+
+    def ping(self):
+        return True
+
+
+def get_storage(backend=None):
+    """Build the backend named by STORAGE_BACKEND (default postgres)"""
+    backend = (backend or os.environ.get('STORAGE_BACKEND', 'postgres')).lower()
+    if backend in ('postgres', 'postgresql'):
+        return PostgresStorage(
+            pool_min=int(os.environ.get('PG_POOL_MIN', 1)),
+            pool_max=int(os.environ.get('PG_POOL_MAX', 10)),
+            pipeline=os.environ.get('PG_PIPELINE', '1') == '1',
+            # PG_PREPARE=0 for pgbouncer in transaction pooling mode
+            prepare=os.environ.get('PG_PREPARE', '1') == '1',
+            autocommit_reads=os.environ.get('PG_AUTOCOMMIT_READS', '1') == '1',
+            pool_timeout=float(os.environ.get('PG_POOL_TIMEOUT', 5)),
+            # A preloading gunicorn master leaves LISTEN to its workers
+            listen=os.environ.get('GUNICORN_PRELOAD') != '1',
+            breaker=CircuitBreaker(
+                failure_rate=float(os.environ.get('DB_BREAKER_FAILURE_RATE', 0.5)),
+                window=int(os.environ.get('DB_BREAKER_WINDOW', 20)),
+                min_calls=int(os.environ.get('DB_BREAKER_MIN_CALLS', 5)),
+                open_seconds=float(os.environ.get('DB_BREAKER_OPEN_SECONDS', 1)),
+                max_open_seconds=float(os.environ.get('DB_BREAKER_MAX_OPEN_SECONDS', 30)),
+            ) if os.environ.get('DB_BREAKER', '1') == '1' else None,
+        )
+    if backend == 'sqlite':
+        return SQLiteStorage(
+            path=os.environ.get('SQLITE_PATH', 'users.db'),
+            mmap_size=int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024)),
+        )
+    if backend == 'mysql':
+        return MySQLStorage(
+            host=os.environ.get('MYSQL_HOST', 'localhost'),
+            port=int(os.environ.get('MYSQL_PORT', 3306)),
+            user=os.environ.get('MYSQL_USER', 'root'),
+            password=os.environ.get('MYSQL_PASSWORD', ''),
+            database=os.environ.get('MYSQL_DATABASE', 'userdb'),
+            pool_size=int(os.environ.get('MYSQL_POOL_SIZE', 10)),
+            pool_timeout=float(os.environ.get('MYSQL_POOL_TIMEOUT', 5)),
+        )
+    if backend == 'memory':
+        return InMemoryStorage()
+    raise StorageError(f"Unknown STORAGE_BACKEND: {backend}")
@@ -0,0 +1,128 @@
+import threading
+import time
+
+import pytest
+
+from admission import AdmissionControl
+
+
+def hello(environ, start_response):
+    start_response('200 OK', [('Content-Type', 'text/plain')])
+    return [b'hello\n']
+
+
+def call(middleware, path='/'):
+    """(status, headers, body iterable) without closing the body"""
+    started = {}
+
+    def start_response(status, headers):
+        started['status'] = status
+        started['headers'] = dict(headers)
+
+    body = middleware({'PATH_INFO': path}, start_response)
+    return started['status'], started['headers'], body
+
+
+def close(body):
+    """What a WSGI server does once it has sent the body"""
+    if hasattr(body, 'close'):
+        body.close()
+
+
+def test_sheds_when_the_queue_is_full():
+    middleware = AdmissionControl(hello, max_concurrent=1, max_queue=0, retry_after=3)
+    status, _, held = call(middleware)
+    assert status == '200 OK'
+    status, headers, body = call(middleware)
+    assert status.startswith('503')
+    assert headers['Retry-After'] == '3'
+    assert b''.join(body) == b'Server busy, please retry\n'
+
+    # The slot is released once the server closes the first body
+    assert list(held) == [b'hello\n']
+    held.close()
+    assert middleware.active == 0
+    status, _, body = call(middleware)
+    assert status == '200 OK'
+    body.close()
+
+
+def test_sheds_after_the_queue_timeout():
+    middleware = AdmissionControl(hello, max_concurrent=1, max_queue=4, queue_timeout=0.05)
+    _, _, held = call(middleware)
+    started = time.monotonic()
+    status, _, _ = call(middleware)
+    assert status.startswith('503')
+    assert time.monotonic() - started >= 0.05
+    assert middleware.waiting == 0
+    held.close()
+
+
+def test_queued_request_is_admitted_on_release():
+    middleware = AdmissionControl(hello, max_concurrent=1, max_queue=1, queue_timeout=5)
+    assert middleware.acquire() is None
+    results = []
+    waiter = threading.Thread(target=lambda: results.append(middleware.acquire()))
+    waiter.start()
+    while not middleware.waiting:
+        time.sleep(0.001)
+    # The queue is full now
+    assert middleware.acquire() == 'queue_full'
+    middleware.release()
+    waiter.join(5)
+    assert results == [None]
+    assert middleware.active == 1
+
+
+def test_bypass_paths_skip_the_cap():
+    middleware = AdmissionControl(hello, max_concurrent=1, max_queue=0)
+    _, _, held = call(middleware)
+    for path in ('/health', '/static/style.css'):
+        status, _, _ = call(middleware, path)
+        assert status == '200 OK'
+    assert middleware.active == 1
+    held.close()
+
+
+def test_app_errors_release_the_slot():
+    def broken(environ, start_response):
+        raise RuntimeError('boom')
+
+    middleware = AdmissionControl(broken, max_concurrent=1, max_queue=0)
+    with pytest.raises(RuntimeError):
+        call(middleware)
+    assert middleware.active == 0
+
+
+def test_concurrency_never_exceeds_the_cap():
+    lock = threading.Lock()
+    running = [0, 0]
+
+    def slow(environ, start_response):
+        with lock:
+            running[0] += 1
+            running[1] = max(running[1], running[0])
+        time.sleep(0.005)
+        with lock:
+            running[0] -= 1
+        return hello(environ, start_response)
+
+    middleware = AdmissionControl(slow, max_concurrent=3, max_queue=5, queue_timeout=0.02)
+    statuses = []
+
+    def client():
+        for _ in range(10):
+            status, _, body = call(middleware)
+            close(body)
+            with lock:
+                statuses.append(status)
+
+    clients = [threading.Thread(target=client) for _ in range(12)]
+    for thread in clients:
+        thread.start()
+    for thread in clients:
+        thread.join(30)
+    assert len(statuses) == 120
+    assert running[1] <= 3
+    assert statuses.count('200 OK') >= 3
+    assert middleware.active == 0 and middleware.waiting == 0
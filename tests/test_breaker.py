@@ -0,0 +1,95 @@
+import time
+
+import pytest
+
+from breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpen
+
+
+def trip(breaker, calls=5):
+    for _ in range(calls):
+        breaker.before_call()
+        breaker.record_failure()
+    assert breaker.state == OPEN
+
+
+def expire(breaker):
+    breaker.open_until = time.monotonic() - 1
+
+
+def test_stays_closed_below_min_calls_and_failure_rate():
+    breaker = CircuitBreaker(failure_rate=0.5, window=10, min_calls=5)
+    for _ in range(4):
+        breaker.record_failure()
+    assert breaker.state == CLOSED
+    for _ in range(6):
+        breaker.record_success()
+    # The window slides: the oldest failure drops out as this one lands
+    breaker.record_failure()
+    assert breaker.state == CLOSED
+    assert breaker.stats()['window_failures'] == 4
+
+
+def test_trips_at_the_failure_rate_and_rejects():
+    breaker = CircuitBreaker(failure_rate=0.5, window=10, min_calls=4, open_seconds=10)
+    breaker.record_success()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == CLOSED
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    assert breaker.trips == 1
+    with pytest.raises(CircuitOpen) as info:
+        breaker.before_call()
+    assert 5 * 0.9 <= info.value.retry_after <= 10
+    assert breaker.stats()['rejected'] == 1
+
+
+def test_half_open_lets_one_probe_through():
+    breaker = CircuitBreaker(open_seconds=10)
+    trip(breaker)
+    expire(breaker)
+    breaker.before_call()
+    assert breaker.state == HALF_OPEN
+    with pytest.raises(CircuitOpen):
+        breaker.before_call()
+
+
+def test_probe_success_closes():
+    breaker = CircuitBreaker(open_seconds=10)
+    trip(breaker)
+    expire(breaker)
+    breaker.before_call()
+    breaker.record_success()
+    assert breaker.state == CLOSED
+    assert breaker.trips == 0
+    breaker.before_call()
+    assert breaker.stats()['window_failures'] == 0
+
+
+def test_probe_failure_reopens_for_longer():
+    breaker = CircuitBreaker(open_seconds=1, max_open_seconds=3)
+    trip(breaker)
+    delays = []
+    for _ in range(4):
+        expire(breaker)
+        breaker.before_call()
+        breaker.record_failure()
+        assert breaker.state == OPEN
+        delays.append(breaker.open_until - time.monotonic())
+    assert breaker.trips == 5
+    # 2s, 4s capped at 3s, ... each jittered down by at most half
+    assert 0.9 <= delays[0] <= 2
+    for delay in delays[1:]:
+        assert 1.4 <= delay <= 3
+
+
+def test_inconclusive_probe_frees_the_slot():
+    breaker = CircuitBreaker(open_seconds=10)
+    trip(breaker)
+    expire(breaker)
+    breaker.before_call()
+    breaker.record_inconclusive()
+    assert breaker.state == HALF_OPEN
+    breaker.before_call()
+    with pytest.raises(CircuitOpen):
+        breaker.before_call()
@@ -0,0 +1,85 @@
+import random
+import threading
+
+from compact_table import CompactTableStorage, CompactUserTable
+from storage import InMemoryStorage
+
+
+def check_matches(table, expected, rng):
+    assert len(table) == len(expected)
+    ordered = sorted(expected.items())
+    assert table.list_page() == ordered
+    for _ in range(20):
+        user_id = rng.randrange(-5, 300)
+        assert table.get(user_id) == expected.get(user_id)
+    wanted = [rng.randrange(-5, 300) for _ in range(30)]
+    assert table.get_many(wanted) == {i: expected[i] for i in wanted if i in expected}
+    after = rng.choice([None, rng.randrange(-5, 300)])
+    limit = rng.choice([None, rng.randrange(1, 20)])
+    rows = [row for row in ordered if after is None or row[0] > after]
+    assert table.list_page(after, limit) == rows[:limit]
+
+
+def test_random_operations_match_a_dict():
+    rng = random.Random(32)
+    for merge_threshold in (1, 4, 64):
+        expected = {i: f"user-{i}" for i in sorted(rng.sample(range(300), 100))}
+        table = CompactUserTable.from_rows(sorted(expected.items()), merge_threshold)
+        for step in range(2000):
+            user_id = rng.randrange(300)
+            if rng.random() < 0.5:
+                name = f"name-{step}"
+                table.insert(user_id, name)
+                expected[user_id] = name
+            else:
+                table.delete(user_id)
+                expected.pop(user_id, None)
+            if step % 100 == 0:
+                check_matches(table, expected, rng)
+        table.merge()
+        check_matches(table, expected, rng)
+
+
+def test_storage_follows_backend_changes():
+    backend = InMemoryStorage()
+    backend.add_if_absent(1, 'a')
+    storage = CompactTableStorage(backend, merge_threshold=2)
+    storage.load()
+
+    # Writes made elsewhere arrive as change notifications
+    backend.add_if_absent(2, 'b')
+    backend.delete(1)
+    assert storage.get(1) is None
+    assert storage.get(2) == 'b'
+
+    storage.add_if_absent(3, 'c')
+    assert storage.list_page() == [(2, 'b'), (3, 'c')]
+
+
+def test_changes_during_a_load_are_replayed():
+    backend = InMemoryStorage()
+    for user_id in range(10):
+        backend.add_if_absent(user_id, str(user_id))
+    storage = CompactTableStorage(backend)
+    exporting = threading.Event()
+    resume = threading.Event()
+    export = backend.export
+
+    def slow_export():
+        rows = list(export())
+        exporting.set()
+        resume.wait(5)
+        return iter(rows)
+
+    backend.export = slow_export
+    loader = threading.Thread(target=storage.load)
+    loader.start()
+    assert exporting.wait(5)
+    backend.add_if_absent(10, '10')
+    backend.delete(0)
+    resume.set()
+    loader.join(5)
+
+    assert storage.get(0) is None
+    assert storage.get(10) == '10'
+    assert len(storage.table) == 10
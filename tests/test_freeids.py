@@ -0,0 +1,82 @@
+import random
+
+from freeids import FreeIdIndex, FreeIdTracker
+from storage import InMemoryStorage
+
+
+def check_matches(index, free):
+    for start, end, next_start in zip(index.starts, index.ends, index.starts[1:]):
+        assert start <= end < next_start - 1
+    assert sum(end - start + 1 for start, end in zip(index.starts, index.ends)) == len(free)
+    for user_id in range(index.min_id - 2, index.max_id + 3):
+        assert (user_id in index) == (user_id in free)
+
+
+def test_random_operations_match_a_set():
+    rng = random.Random(34)
+    min_id, max_id = 1, 300
+    used = sorted(rng.sample(range(min_id - 5, max_id + 5), 150))
+    index = FreeIdIndex.from_sorted(used, min_id, max_id, reserve_ttl=3600)
+    free = set(range(min_id, max_id + 1)) - set(used)
+    check_matches(index, free)
+    for step in range(5000):
+        user_id = rng.randrange(min_id - 3, max_id + 4)
+        action = rng.random()
+        if action < 0.45:
+            index.mark_used(user_id)
+            free.discard(user_id)
+        elif action < 0.9:
+            index.mark_free(user_id)
+            if min_id <= user_id <= max_id:
+                free.add(user_id)
+        else:
+            count = rng.randint(1, 5)
+            expected = sorted(free)[:count]
+            assert index.suggest(count) == expected
+            free.difference_update(expected)
+        if step % 100 == 0:
+            check_matches(index, free)
+    check_matches(index, free)
+
+
+def test_suggested_ids_are_held_until_they_lapse():
+    index = FreeIdIndex.from_sorted([2], 1, 10, reserve_ttl=3600)
+    assert index.suggest(3) == [1, 3, 4]
+    assert index.suggest(2) == [5, 6]
+    for user_id in index.reserved:
+        index.reserved[user_id] = 0
+    assert index.suggest(4) == [1, 3, 4, 5]
+    assert index.interval_count() == 1
+
+
+def test_suggest_when_full():
+    index = FreeIdIndex.from_sorted(range(1, 11), 1, 10)
+    assert index.suggest(2) == []
+    index.mark_free(5)
+    assert index.suggest(2) == [5]
+
+
+class HoldingStorage(InMemoryStorage):
+    """Another worker already holds the ids in held"""
+
+    def __init__(self, held):
+        super().__init__()
+        self.held = set(held)
+
+    def reserve_ids(self, user_ids, ttl):
+        return [user_id for user_id in user_ids if user_id not in self.held]
+
+
+def test_tracker_follows_storage_and_skips_held_ids():
+    storage = HoldingStorage(held={2, 3})
+    storage.add_if_absent(1, 'a')
+    tracker = FreeIdTracker(storage)
+    assert tracker.suggest(2) == []
+    tracker.rebuild()
+    assert tracker.ready
+    assert tracker.suggest(2) == [4, 5]
+
+    storage.add_if_absent(6, 'b')
+    storage.delete(1)
+    assert 6 not in tracker.index
+    assert tracker.suggest(2) == [1, 7]
@@ -0,0 +1,123 @@
+import random
+import threading
+
+from idbitmap import ARRAY_MAX, IdBitmap, IdIndex
+from storage import InMemoryStorage
+
+
+def random_ids(rng, count):
+    # Dense enough in one chunk to cross ARRAY_MAX, plus sparse and edge ids
+    ids = set(rng.sample(range(20_000), count))
+    ids.update(rng.randrange(-2 ** 31, 2 ** 31) for _ in range(50))
+    ids.update((-2 ** 31, 2 ** 31 - 1, 0, -1))
+    return ids
+
+
+def check_matches(bitmap, expected, rng):
+    assert len(bitmap) == len(expected)
+    for user_id in rng.sample(sorted(expected), min(200, len(expected))):
+        assert user_id in bitmap
+    for _ in range(200):
+        user_id = rng.randrange(-100, 25_000)
+        assert (user_id in bitmap) == (user_id in expected)
+
+
+def test_random_operations_match_a_set():
+    rng = random.Random(33)
+    expected = random_ids(rng, ARRAY_MAX + 500)
+    bitmap = IdBitmap.from_sorted(sorted(expected))
+    check_matches(bitmap, expected, rng)
+    for step in range(20_000):
+        user_id = rng.randrange(20_000)
+        if rng.random() < 0.45:
+            bitmap.add(user_id)
+            expected.add(user_id)
+        else:
+            bitmap.discard(user_id)
+            expected.discard(user_id)
+        if step % 1000 == 0:
+            check_matches(bitmap, expected, rng)
+    check_matches(bitmap, expected, rng)
+
+
+def test_out_of_range_ids_are_ignored():
+    bitmap = IdBitmap()
+    bitmap.add(2 ** 31)
+    bitmap.add(-2 ** 31 - 1)
+    assert len(bitmap) == 0
+    assert 2 ** 31 not in bitmap
+
+
+def test_bytes_round_trip():
+    rng = random.Random(7)
+    expected = random_ids(rng, ARRAY_MAX + 10)
+    bitmap = IdBitmap.from_sorted(sorted(expected))
+    loaded, saved_at = IdBitmap.from_bytes(bitmap.to_bytes(saved_at=123.0))
+    assert saved_at == 123.0
+    check_matches(loaded, expected, rng)
+
+
+def test_index_loaded_from_disk_is_not_trusted_for_absence(tmp_path):
+    path = str(tmp_path / 'ids.bitmap')
+    old = InMemoryStorage()
+    old.add_if_absent(1, 'a')
+    saved = IdIndex(old, path)
+    saved.start()
+    saved.save()
+
+    # The table gained id 2 after the file was saved
+    storage = InMemoryStorage()
+    storage.add_if_absent(1, 'a')
+    storage.add_if_absent(2, 'b')
+    scanning = threading.Event()
+    resume = threading.Event()
+    export = storage.export
+
+    def slow_export():
+        rows = list(export())
+        scanning.set()
+        resume.wait(5)
+        return iter(rows)
+
+    storage.export = slow_export
+    index = IdIndex(storage, path)
+    index.start()
+    assert scanning.wait(5)
+    assert index.ready and not index.complete
+    assert index.probably_present(1)
+    assert not index.definitely_absent(2)
+
+    resume.set()
+    for thread in threading.enumerate():
+        if thread.name == 'id-bitmap-rebuild':
+            thread.join(5)
+    assert index.complete
+    assert index.probably_present(2)
+    assert index.definitely_absent(3)
+
+
+def test_reload_during_a_scan_scans_again():
+    storage = InMemoryStorage()
+    storage.add_if_absent(1, 'a')
+    index = IdIndex(storage)
+    scans = []
+    scanning = threading.Event()
+    resume = threading.Event()
+    export = storage.export
+
+    def slow_export():
+        rows = list(export())
+        scans.append(rows)
+        scanning.set()
+        resume.wait(5)
+        return iter(rows)
+
+    storage.export = slow_export
+    builder = threading.Thread(target=index.rebuild)
+    builder.start()
+    assert scanning.wait(5)
+    index._on_change('reload', None, None)
+    resume.set()
+    builder.join(5)
+    assert len(scans) == 2
+    assert index.complete
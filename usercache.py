@@ -0,0 +1,235 @@
+"""In-process user cache with coalesced misses.
+
+CachedStorage wraps another backend. get() answers from an LRU/TTL cache
+and sends misses through a SingleFlight, so a burst of requests for one id
+(including the burst right after its entry expires) costs one query.
+Entries are updated or dropped from the backend's change notifications.
+
+The hottest entries can be dumped to a file and loaded back at the next
+start, provided the table's version marker has not moved in between.
+"""
+import os
+import struct
+import threading
+import time
+from collections import OrderedDict
+
+from singleflight import SingleFlight
+from storage import Storage
+
+# Marks "not cached", since None is a cached "no such user"
+MISS = object()
+
+# Dump layout: header, then per entry an int64 id, a uint16 name length and
+# the UTF-8 name, most recently used first
+DUMP_MAGIC = b'UCACHE01'
+DUMP_HEADER = struct.Struct('<8sqdI')  # magic, table version, dumped_at, count
+DUMP_ENTRY = struct.Struct('<qH')
+
+
+class UserCache:
+    """Thread-safe LRU of id -> name (or None for a known miss) with a TTL"""
+
+    def __init__(self, ttl=30.0, max_size=100_000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.ttl > 0 and self.max_size > 0
+
+    def get(self, user_id):
+        if not self.enabled:
+            return MISS
+        with self._lock:
+            entry = self.entries.get(user_id)
+            if entry is None or entry[1] <= time.monotonic():
+                self.misses += 1
+                return MISS
+            self.entries.move_to_end(user_id)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, user_id, name, generation=None):
+        """Cache a value; skipped if anything was invalidated since generation"""
+        if not self.enabled:
+            return
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            self.entries[user_id] = (name, time.monotonic() + self.ttl)
+            self.entries.move_to_end(user_id)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, user_id=None):
+        """Drop one id, or everything when user_id is None"""
+        with self._lock:
+            self.generation += 1
+            if user_id is None:
+                self.entries.clear()
+            else:
+                self.entries.pop(user_id, None)
+
+    def items(self, limit):
+        """Up to limit unexpired (id, name) entries for known users, most recently used first"""
+        now = time.monotonic()
+        with self._lock:
+            entries = list(self.entries.items())
+        items = []
+        for user_id, (name, expires) in reversed(entries):
+            if len(items) >= limit:
+                break
+            if name is not None and expires > now:
+                items.append((user_id, name))
+        return items
+
+    def hot_keys(self, limit):
+        """Up to limit cached ids, most recently used first"""
+        with self._lock:
+            keys = list(self.entries)
+        return keys[::-1][:limit]
+
+    def stats(self):
+        return {
+            'size': len(self.entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'ttl': self.ttl,
+            'max_size': self.max_size,
+        }
+
+
+class CachedStorage(Storage):
+    """Cache and coalesce single-user reads in front of another backend"""
+
+    name = 'cached'
+
+    def __init__(self, backend, ttl=30.0, max_size=100_000):
+        self.backend = backend
+        self.cache = UserCache(ttl, max_size)
+        self.flights = SingleFlight()
+        # Without a cache there is nothing to invalidate; subscribing would
+        # start a listener and a NOTIFY per write for nothing
+        if self.cache.enabled:
+            backend.subscribe(self._on_change)
+
+    def _on_change(self, op, user_id, name):
+        if op == 'reload':
+            self.cache.invalidate()
+        else:
+            self.cache.invalidate(user_id)
+
+    def _load(self, user_id):
+        generation = self.cache.generation
+        name = self.backend.get(user_id)
+        self.cache.put(user_id, name, generation)
+        return name
+
+    def get(self, user_id):
+        name = self.cache.get(user_id)
+        if name is not MISS:
+            return name
+        return self.flights.do(user_id, lambda: self._load(user_id))
+
+    def initialize(self):
+        self.backend.initialize()
+
+    def get_many(self, user_ids):
+        found = {}
+        misses = []
+        for user_id in user_ids:
+            name = self.cache.get(user_id)
+            if name is MISS:
+                misses.append(user_id)
+            elif name is not None:
+                found[user_id] = name
+        if misses:
+            generation = self.cache.generation
+            loaded = self.backend.get_many(misses)
+            for user_id in misses:
+                self.cache.put(user_id, loaded.get(user_id), generation)
+            found.update(loaded)
+        return found
+
+    def add_if_absent(self, user_id, name):
+        return self.backend.add_if_absent(user_id, name)
+
+    def add_many_if_absent(self, rows):
+        return self.backend.add_many_if_absent(rows)
+
+    def delete(self, user_id):
+        return self.backend.delete(user_id)
+
+    def list_page(self, after_id=None, limit=None):
+        return self.backend.list_page(after_id, limit)
+
+    def bulk_load(self, rows):
+        return self.backend.bulk_load(rows)
+
+    def export(self):
+        return self.backend.export()
+
+    def lease_id_block(self, size):
+        return self.backend.lease_id_block(size)
+
+    def reserve_ids(self, user_ids, ttl):
+        return self.backend.reserve_ids(user_ids, ttl)
+
+    def ping(self):
+        return self.backend.ping()
+
+    def version(self):
+        return self.backend.version()
+
+    def close(self):
+        self.backend.close()
+
+    def subscribe(self, callback):
+        self.backend.subscribe(callback)
+
+
+def dump_cache(cache, path, version, limit=100_000):
+    """Atomically write the cache's hottest entries, stamped with version"""
+    items = cache.items(limit)
+    parts = [DUMP_HEADER.pack(DUMP_MAGIC, version, time.time(), len(items))]
+    for user_id, name in items:
+        encoded = name.encode('utf-8')
+        parts.append(DUMP_ENTRY.pack(user_id, len(encoded)))
+        parts.append(encoded)
+    tmp_path = f"{path}.tmp.{os.getpid()}"
+    with open(tmp_path, 'wb') as f:
+        f.write(b''.join(parts))
+    os.replace(tmp_path, path)
+    return len(items)
+
+
+def read_cache_dump(path):
+    """(version, dumped_at, [(id, name), ...]) from a dump file
+
+    Raises ValueError for a file that is not a complete dump.
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    if len(data) < DUMP_HEADER.size:
+        raise ValueError('truncated header')
+    magic, version, dumped_at, count = DUMP_HEADER.unpack_from(data)
+    if magic != DUMP_MAGIC:
+        raise ValueError('not a user cache dump')
+    items = []
+    offset = DUMP_HEADER.size
+    for _ in range(count):
+        if offset + DUMP_ENTRY.size > len(data):
+            raise ValueError('truncated entry')
+        user_id, length = DUMP_ENTRY.unpack_from(data, offset)
+        offset += DUMP_ENTRY.size
+        items.append((user_id, data[offset:offset + length].decode('utf-8')))
+        offset += length
+    if offset != len(data):
+        raise ValueError('trailing data')
+    return version, dumped_at, items
@@ -0,0 +1,104 @@
+"""Per-worker warm-up before a worker reports ready.
+
+Runs once at worker start on a background thread: fills the connection
+pool, compiles every template, runs each read query once and primes the
+user cache: straight from the previous run's cache dump when the table
+has not changed since, otherwise by re-reading the dumped (or hot-key
+file) ids. The readiness checker reports not-ready until it finishes, so
+a deploy's first requests do not pay for any of it.
+"""
+import os
+import time
+
+from storage import StorageError
+from usercache import read_cache_dump
+
+
+def compile_templates(app):
+    for name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(name)
+
+
+def load_hot_keys(path, limit):
+    """Up to limit ids from a hot-key file, hottest first; [] if missing"""
+    ids = []
+    try:
+        with open(path) as f:
+            for line in f:
+                if len(ids) >= limit:
+                    break
+                try:
+                    ids.append(int(line))
+                except ValueError:
+                    continue
+    except FileNotFoundError:
+        pass
+    return ids
+
+
+def save_hot_keys(path, ids):
+    """Write ids one per line, atomically replacing path"""
+    tmp_path = f"{path}.tmp.{os.getpid()}"
+    with open(tmp_path, 'w') as f:
+        f.writelines(f"{user_id}\n" for user_id in ids)
+    os.replace(tmp_path, path)
+
+
+def prime_ids(storage, ids, batch_size=1000):
+    """Read ids through the cache, returning how many exist"""
+    found = 0
+    for start in range(0, len(ids), batch_size):
+        found += len(storage.get_many(ids[start:start + batch_size]))
+    return found
+
+
+def prime_from_dump(storage, path, max_age):
+    """Load a cache dump (see usercache.dump_cache); returns users cached
+
+    Values are trusted only if the table's version marker still matches
+    the one the dump was stamped with and the dump is under max_age
+    seconds old; otherwise just its ids are re-read from the database.
+    """
+    try:
+        version, dumped_at, items = read_cache_dump(path)
+    except FileNotFoundError:
+        return 0
+    except (OSError, ValueError) as e:
+        print(f"Ignoring cache dump {path}: {e}")
+        return 0
+
+    cache = storage.cache
+    generation = cache.generation
+    current = storage.version()
+    age = time.time() - dumped_at
+    if current is not None and current == version and age <= max_age:
+        for user_id, name in items:
+            cache.put(user_id, name, generation)
+        print(f"Loaded {len(items)} cached users from {path} ({age:.0f}s old)")
+        return len(items)
+
+    print(f"Cache dump {path} is stale (version {version} vs {current}, {age:.0f}s old), re-reading its ids")
+    return prime_ids(storage, [user_id for user_id, _ in items])
+
+
+def warm_up(app, storage, database, hot_keys_path=None, hot_keys_limit=10_000,
+            cache_dump_path=None, cache_dump_max_age=3600.0):
+    """Warm this worker; storage errors are reported, not raised"""
+    started = time.monotonic()
+    compile_templates(app)
+    primed = 0
+    try:
+        database.warm()
+        # One of each read, so they are prepared and their plans cached
+        storage.get(0)
+        storage.get_many([0])
+        storage.list_page(limit=1)
+        if cache_dump_path:
+            primed += prime_from_dump(storage, cache_dump_path, cache_dump_max_age)
+        if hot_keys_path:
+            primed += prime_ids(storage, load_hot_keys(hot_keys_path, hot_keys_limit))
+    except StorageError as e:
+        print(f"Warm-up could not reach the database: {e}")
+    except Exception as e:
+        print(f"Warm-up error: {e}")
+    print(f"Warm-up finished in {time.monotonic() - started:.2f}s, {primed} hot users cached")
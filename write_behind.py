@@ -0,0 +1,146 @@
+"""Group commit for /add inserts.
+
+Requests hand their row to a per-worker batcher thread and wait. The
+thread flushes every max_rows rows or max_delay seconds, whichever comes
+first, as one add_many_if_absent call (one statement and one commit on
+Postgres), then wakes each request with its own outcome.
+
+A request waits no longer than its deadline. If that runs out first it
+gets DeadlineExceeded, and the outcome of its insert is unknown: the
+batch may still commit it afterwards. The flush itself runs under a
+budget as long as the longest wait in the batch.
+"""
+import queue
+import threading
+import time
+
+import deadlines
+from storage import StorageUnavailable
+
+
+class _PendingInsert:
+    __slots__ = ('user_id', 'name', 'expires', 'done', 'outcome', 'error')
+
+    def __init__(self, user_id, name, expires):
+        self.user_id = user_id
+        self.name = name
+        # When the waiting request gives up (monotonic clock)
+        self.expires = expires
+        self.done = threading.Event()
+        self.outcome = None
+        self.error = None
+
+
+class WriteBehindBatcher:
+    """Batches add_if_absent calls from many threads into group commits"""
+
+    def __init__(self, storage, max_rows=100, max_delay=0.005, timeout=10.0):
+        self.storage = storage
+        self.max_rows = max_rows
+        self.max_delay = max_delay
+        self.timeout = timeout
+        self.queue = queue.Queue()
+        self.flushes = 0
+        self.rows = 0
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def _ensure_thread(self):
+        # Started on first use, so a pre-fork parent never owns the thread
+        if self._thread is None or not self._thread.is_alive():
+            with self._lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(target=self._run, name='write-behind', daemon=True)
+                    self._thread.start()
+
+    def add_if_absent(self, user_id, name):
+        """Same contract as Storage.add_if_absent, committed with other rows"""
+        self._ensure_thread()
+        wait = self.timeout
+        left = deadlines.remaining()
+        if left is not None:
+            wait = min(wait, max(left, 0.0))
+        pending = _PendingInsert(user_id, name, time.monotonic() + wait)
+        self.queue.put(pending)
+        if not pending.done.wait(wait):
+            message = f"Insert of user {user_id} was not flushed in time; it may still be committed"
+            if left is not None and left <= self.timeout:
+                raise deadlines.exceeded(message)
+            raise TimeoutError(message)
+        if isinstance(pending.error, deadlines.DeadlineExceeded):
+            raise deadlines.exceeded(str(pending.error))
+        if pending.error is not None:
+            raise pending.error
+        return pending.outcome
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + self.max_delay
+            while len(batch) < self.max_rows:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._flush(batch)
+
+    def _flush(self, batch):
+        # The first row for an id goes to the database; later rows for the
+        # same id in this batch conflict with it
+        first = {}
+        rows = []
+        for pending in batch:
+            if pending.user_id not in first:
+                first[pending.user_id] = pending
+                rows.append((pending.user_id, pending.name))
+
+        # Statement and lock timeouts for the flush, from the longest wait
+        left = max(pending.expires for pending in batch) - time.monotonic()
+        try:
+            with deadlines.budget(max(left, 0.001)):
+                outcomes = self.storage.add_many_if_absent(rows)
+        except (StorageUnavailable, deadlines.DeadlineExceeded) as e:
+            print(f"Write-behind flush of {len(rows)} rows failed: {e}")
+            for pending in batch:
+                pending.error = e
+                pending.done.set()
+            return
+        except Exception as e:
+            # Probably one bad row (say, a name too long for the column)
+            # failing the whole statement: retry singly so only it fails
+            print(f"Write-behind flush of {len(rows)} rows failed, retrying one by one: {e}")
+            outcomes = None
+
+        for index, (user_id, name) in enumerate(rows):
+            leader = first[user_id]
+            if outcomes is not None:
+                leader.outcome = outcomes[index]
+                continue
+            try:
+                with deadlines.budget(max(leader.expires - time.monotonic(), 0.001)):
+                    leader.outcome = self.storage.add_if_absent(user_id, name)
+            except Exception as e:
+                leader.error = e
+        for pending in batch:
+            leader = first[pending.user_id]
+            if pending is not leader:
+                if leader.error is not None:
+                    pending.error = leader.error
+                else:
+                    inserted, existing = leader.outcome
+                    pending.outcome = (False, leader.name if inserted else existing)
+            pending.done.set()
+
+        self.flushes += 1
+        self.rows += len(rows)
+
+    def stats(self):
+        return {
+            'flushes': self.flushes,
+            'rows': self.rows,
+            'avg_batch': self.rows / self.flushes if self.flushes else 0.0,
+            'queued': self.queue.qsize(),
+        }